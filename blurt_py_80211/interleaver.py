@@ -24,3 +24,25 @@ def interleave(input, Ncbps, Nbpsc, reverse=False):
         p = interleave_inverse_permutation(Ncbps, Nbpsc)
     return input[:,p].flatten()
 
+
+_deinterleave_depuncture_maps = {}
+
+def deinterleave_depuncture_map(Ncbps, Nbpsc, m):
+    """
+    Gather indices from one symbol of demapped bits (Ncbps of them, then an
+    erasure) to depunctured code bits, punctured positions taking the erasure.
+    """
+    key = (Ncbps, Nbpsc, tuple(m))
+    if key not in _deinterleave_depuncture_maps:
+        m = np.asarray(m, bool)
+        k = np.empty(Ncbps // m.sum() * m.size, int)
+        k[:] = Ncbps
+        k[np.tile(m, k.size // m.size)] = interleave_permutation(Ncbps, Nbpsc)
+        _deinterleave_depuncture_maps[key] = k
+    return _deinterleave_depuncture_maps[key]
+
+def deinterleave_depuncture(input, Ncbps, Nbpsc, m):
+    symbols = input.size // Ncbps
+    input = input[:symbols*Ncbps].reshape(symbols, Ncbps)
+    input = np.concatenate((input, np.zeros((symbols, 1), input.dtype)), 1)
+    return input[:,deinterleave_depuncture_map(Ncbps, Nbpsc, m)].flatten()
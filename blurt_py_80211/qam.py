@@ -40,16 +40,20 @@ qam64 = qam_constellation(6)
 def encode(interleaved_bits, rate):
     return rate.constellation[util.shiftin(interleaved_bits, rate.Nbpsc)]
 
-def demapper(data, constellation, dispersion, n):
-    squared_distance = np.abs(constellation[np.newaxis,:] - data[:,np.newaxis])**2
-    ll = -np.log(np.pi * dispersion) - squared_distance / dispersion
-    ll -= np.logaddexp.reduce(ll, 1)[:,np.newaxis]
-    j = np.arange(1<<n)
-    ll0 = np.zeros((data.shape[0], n), float)
-    ll1 = np.zeros((data.shape[0], n), float)
-    for i in xrange(n):
-        idx0 = np.where(0 == (j & (1<<i)))[0]
-        idx1 = np.where(j & (1<<i))[0]
-        ll0[:,i] = np.logaddexp.reduce(ll[:,idx0], 1)
-        ll1[:,i] = np.logaddexp.reduce(ll[:,idx1], 1)
-    return np.int64(np.clip(10.*(ll1-ll0), -1e4, 1e4)).flatten()
+def demapper(data, constellation, dispersion, n, method='exact'):
+    # The in-phase and quadrature halves of each symbol's bits are separately
+    # Gray coded, so demap each axis as a PAM over 2**(n/2) levels.  method is
+    # 'exact' (log-sum-exp) or 'maxlog'.
+    reduce = np.logaddexp.reduce if method == 'exact' else np.maximum.reduce
+    h = max(n >> 1, 1)
+    levels = constellation[:1<<h].real
+    j = np.arange(1<<h)
+    llr = []
+    for x in ([data.real] if n == 1 else [data.real, data.imag]):
+        ll = -(x[:,np.newaxis] - levels[np.newaxis,:])**2 / dispersion
+        for i in range(h):
+            idx0 = np.where(0 == (j & (1<<i)))[0]
+            idx1 = np.where(j & (1<<i))[0]
+            llr.append(reduce(ll[:,idx1], 1) - reduce(ll[:,idx0], 1))
+    llr = np.array(llr).T
+    return np.int64(np.clip(10.*llr, -1e4, 1e4)).flatten()
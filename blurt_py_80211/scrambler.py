@@ -7,6 +7,16 @@ for i in range(127):
     s = np.uint16((s << 1) ^ (1 & ((s >> 3) ^ (s >> 6))))
     scrambler_y[i] = s&1
 
+# Packed sequence bank: octet k of scrambler_bank[state] holds bits 8k..8k+7
+# of the sequence from that state, LSB first.  The octet sequence repeats
+# every 127 octets, and the bank is unrolled to cover an MTU-sized frame.
+scrambler_octets = (np.tile(scrambler_y.T, (1, 8)).reshape(128, 127, 8) << np.arange(8)).sum(2).astype(np.uint8)
+scrambler_bank = np.tile(scrambler_octets, (1, 13))
+
+# the first seven bits of SERVICE are zero, so its first octet gives the state
+scrambler_state_lookup = np.zeros(128, int)
+scrambler_state_lookup[scrambler_bank[:,0] & 0x7f] = np.arange(128)
+
 def scrambler(initial):
     y = scrambler_y[:,np.uint8(initial)]
     i = 0
@@ -25,3 +35,13 @@ def scramble(input, multipleof, scramblerState=0x7F):
     output ^= np.tile(sc, (output.size+126)/127)[:output.size]
     output[input.size:input.size+6] = 0
     return output
+
+def scramble_octets(octets, scramblerState=0x7F):
+    octets = np.asarray(octets, np.uint8)
+    if octets.size <= scrambler_bank.shape[1]:
+        return octets ^ scrambler_bank[np.uint8(scramblerState),:octets.size]
+    return octets ^ np.resize(scrambler_octets[np.uint8(scramblerState)], octets.size)
+
+def descramble_octets(octets):
+    octets = np.asarray(octets, np.uint8)
+    return scramble_octets(octets, scrambler_state_lookup[octets[0] & 0x7f])
@@ -2,4 +2,4 @@
 from .stream import IOStream, InArrayStream, OutArrayStream
 from .session import IOSession, play, record, play_and_record
 from .agc import MicrophoneAGCAdapter, CSMAOutStreamAdapter
-from .graph_adapter import InStream_SourceBlock, OutStream_SinkBlock, IOSession_Block
+from .graph_adapter import InStream_SourceBlock, OutStream_SinkBlock, ScheduledOutStream_SinkBlock, IOSession_Block
@@ -1,6 +1,9 @@
 # adapter from audio stream to asynchronous graph
 import time
 import warnings
+import threading
+import collections
+import traceback
 import numpy as np
 from typing import Tuple
 import queue
@@ -71,6 +74,178 @@ class OutStream_SinkBlock(IOStream, Block):
     def outDone(self):
         return self.input_queues[0].closed
 
+class ScheduledOutStream_SinkBlock(IOStream, Block):
+    """
+    An output stream that renders its own frames.  Items arriving on its
+    input are handed to render on a dedicated thread, and the waveforms it
+    returns are written into a preallocated ring ahead of the audio output
+    clock, so the IO proc only ever copies out of the ring.
+
+    Ring indices run on with the output clock, which is tracked from the
+    outputTime passed to read().  A frame is placed to start lead seconds
+    after it arrived, or right after the frame before it, whichever is
+    later; silence fills the gaps.  It misses its deadline if the output had
+    already passed that start by the time it was rendered, or if the output
+    caught up with it while it was being written.
+
+    Counters: frames (written to the ring), misses, and dropped (items in
+    batches that render failed on; the error is printed and rendering goes
+    on).  latencies holds the render latency, from arrival until the whole
+    waveform is in the ring, of recent frames.
+    """
+    inputs = [Port(Array[[None], np.uint8])]
+    outputs = []
+
+    def __init__(self, render, Fs, nChannelsPerFrame, lead=.1, capacity=1<<18):
+        super().__init__()
+        self.render = render # list of items -> list of waveforms
+        self.Fs = Fs
+        self.nChannelsPerFrame = nChannelsPerFrame
+        self.lead = lead
+        self.ring = np.zeros((capacity, nChannelsPerFrame), np.float32)
+        self.cv = threading.Condition()
+        self.pending = collections.deque()
+        self.rendering = False
+        self.running = False
+        self.thread = None
+        self.written = 0   # ring index up to which samples are ready
+        self.played = 0    # ring index of the next sample read() hands out
+        self.clock = None  # (ring index, output time) at the last read()
+        self.frames = 0
+        self.misses = 0
+        self.dropped = 0
+        self.latencies = collections.deque(maxlen=1024)
+        self.warnOnMiss = True
+
+    def start(self):
+        super().start()
+        with self.cv:
+            self.running = True
+        self.thread = threading.Thread(target=self.renderLoop, daemon=True)
+        self.thread.start()
+
+    def stopped(self):
+        with self.cv:
+            self.running = False
+            self.cv.notify_all()
+        self.thread.join()
+        super().stopped()
+
+    def process(self):
+        self.enqueue([item for item, in self.iterinput()])
+
+    def enqueue(self, items, arrival=None):
+        # arrival is on the time.monotonic() clock read() is given times on
+        if items:
+            t = time.monotonic() if arrival is None else arrival
+            with self.cv:
+                self.pending.extend((item, t) for item in items)
+                self.cv.notify_all()
+
+    def renderLoop(self):
+        while True:
+            with self.cv:
+                while self.running and not self.pending:
+                    self.cv.wait()
+                if not self.running:
+                    return
+                batch = list(self.pending)
+                self.pending.clear()
+                self.rendering = True
+            try:
+                waveforms = self.render([item for item, arrival in batch])
+                for waveform in waveforms:
+                    if waveform.ndim != 2 or waveform.shape[1] != self.nChannelsPerFrame:
+                        raise ValueError('shape mismatch')
+            except Exception:
+                # drop the batch, but keep rendering
+                traceback.print_exc()
+                waveforms = []
+                with self.cv:
+                    self.dropped += len(batch)
+            for (item, arrival), waveform in zip(batch, waveforms):
+                self.schedule(waveform, arrival)
+            with self.cv:
+                self.rendering = False
+
+    def schedule(self, waveform, arrival):
+        with self.cv:
+            # the intended start, unless the output has already passed it
+            start = self.written
+            if self.clock is not None:
+                index, outputTime = self.clock
+                start = max(start, index + int(round((arrival + self.lead - outputTime) * self.Fs)))
+            late = self.clock is not None and self.played > start
+            start = max(start, self.played)
+        intact = self.put(waveform, start)
+        with self.cv:
+            self.frames += 1
+            self.latencies.append(time.monotonic() - arrival)
+            if late or not intact:
+                self.misses += 1
+                if self.warnOnMiss:
+                    warnings.warn('%s missed a deadline' % self.__class__.__name__, UnderrunWarning)
+
+    def put(self, samples, start):
+        # write samples at ring indices from start on, waiting for room;
+        # returns False if the output reached any of them first
+        capacity = self.ring.shape[0]
+        intact = True
+        i = 0
+        while i < samples.shape[0]:
+            with self.cv:
+                while self.running and start + i >= self.played + capacity:
+                    self.cv.wait()
+                if not self.running:
+                    return intact
+                if start + i < self.played:
+                    # too late for these; the ones after may still make it
+                    intact = False
+                    i = min(self.played - start, samples.shape[0])
+                    continue
+                n = min(samples.shape[0] - i, self.played + capacity - (start + i))
+            # read() never touches indices at or past written, so the copy
+            # runs without the lock
+            j = (start + i) % capacity
+            m = min(n, capacity - j)
+            self.ring[j:j+m] = samples[i:i+m]
+            self.ring[:n-m] = samples[i+m:i+n]
+            with self.cv:
+                stale = self.played - (start + i)
+                if stale > 0:
+                    # the output overtook the copy; clear what it skipped
+                    intact = False
+                    stale = min(stale, n)
+                    self.ring[j:j+min(stale, m)] = 0
+                    self.ring[:max(stale-m, 0)] = 0
+                self.written = start + i + n
+            i += n
+        return intact
+
+    # IOStream methods
+
+    def read(self, nFrames, outputTime, now):
+        result = np.zeros((nFrames, self.nChannelsPerFrame), np.float32)
+        capacity = self.ring.shape[0]
+        with self.cv:
+            self.clock = (self.played, outputTime)
+            n = max(min(self.written - self.played, nFrames), 0)
+            j = self.played % capacity
+            m = min(n, capacity - j)
+            result[:m] = self.ring[j:j+m]
+            result[m:n] = self.ring[:n-m]
+            # leave silence behind for any gaps the next frames skip over
+            self.ring[j:j+m] = 0
+            self.ring[:n-m] = 0
+            self.played += nFrames
+            self.cv.notify_all()
+        return result
+
+    def outDone(self):
+        with self.cv:
+            return self.input_queues[0].closed and not self.pending and not self.rendering and \
+                self.written <= self.played
+
 class IOSession_Block(Block):
     inputs = []
     outputs = []
@@ -10,10 +10,13 @@ class FragmentationBlock(Block):
     inputs = [Port(Packet)]
     outputs = [Port(Array[[None], np.uint8])]
 
-    def __init__(self, pdb):
+    def __init__(self, pdb, hint=None):
         super().__init__()
         self.pdb = pdb
         self.pdb.sendMPDU = self._sendMPDU
+        if hint is not None:
+            # e.g. the encoder's WaveformCache.hint
+            self.pdb.hintMPDU = hint
 
     def process(self):
         for packet, in self.iterinput():
@@ -191,6 +191,10 @@ class PDB:
     def sendMPDU(self, d: np.ndarray, cb: Callable[[float], None]):
         pass
 
+    def hintMPDU(self, d: np.ndarray):
+        # d is likely to be sent again
+        pass
+
     def recvMSDU(self, p: Packet):
         read, readOctets = p.readBits, p.readOctets
         header_stack = [] # contains tuples (encoding for NH=0, encoding for NH=1, uncompressed encoding, length of uncompressed data)
@@ -378,7 +382,12 @@ class PDB:
                 # Gets called when we know the time fragment i will be transmitted.
                 # XXX self.runloop.addTimer(self._retryHandler, delay=2.)
                 pass
-            self.sendMPDU(np.frombuffer(p.ll_sa + p.ll_da + f, np.uint8))
+            mpdu = np.frombuffer(p.ll_sa + p.ll_da + f, np.uint8)
+            if fragment:
+                # fragments are acknowledged by bitmap, so any of them may
+                # have to be sent again
+                self.hintMPDU(mpdu)
+            self.sendMPDU(mpdu)
 
     def compressIPv6SA(self, IPv6_SA: bytes, p: Packet):
         # 0-byte options
@@ -1,3 +1,4 @@
+import concurrent.futures
 import numpy as np
 from . import kernels
 
@@ -7,9 +8,161 @@ def mul(a, b):
 output_map = 1 & (mul(np.array([109, 79]), np.arange(128)) >> 6)
 output_map_soft = output_map * 2 - 1
 
+llr_max = 127 # soft bits saturate to int8 on their way into the decoder
+
+def _encoder_byte_table():
+    # coded bits for each (state, input byte), where the state holds the
+    # previous six input bits with the newest in bit 5 (i.e. last byte >> 2)
+    hist = np.arange(64)[:,None]
+    byte = np.arange(256)[None,:]
+    coded = np.zeros((64, 256, 16), np.uint8)
+    for i in range(8):
+        reg = hist | (((byte >> i) & 1) << 6)
+        coded[:,:,2*i+0] = output_map[0,reg]
+        coded[:,:,2*i+1] = output_map[1,reg]
+        hist = reg >> 1
+    return coded
+
+_encoder_tables = {}
+
+def _punctured_encoder_tables(puncturingMatrix):
+    """
+    For each byte position g in a group of len(puncturingMatrix)//2 bytes (one
+    whole number of puncturing periods), a table from (state, byte) to the
+    surviving coded bits packed LSB first, and the bit offset of that byte's
+    output within the group.
+    """
+    key = tuple(bool(m) for m in puncturingMatrix)
+    if key not in _encoder_tables:
+        if 'coded' not in _encoder_tables:
+            _encoder_tables['coded'] = _encoder_byte_table()
+        coded = _encoder_tables['coded']
+        m = np.array(key)
+        tables = []
+        offset = 0
+        for g in range(m.size//2):
+            kept = coded[:,:,m[(16*g + np.arange(16)) % m.size]].astype(np.uint64)
+            tables.append((kept << np.arange(kept.shape[-1], dtype=np.uint64)).sum(-1, np.uint64))
+            tables.append(offset)
+            offset += kept.shape[-1]
+        _encoder_tables[key] = tables[0::2], tables[1::2], m.sum()
+    return _encoder_tables[key]
+
+def encode_packed(octets, puncturingMatrix=(1,1)):
+    """
+    Encode and puncture packed (LSB first) input bits, returning packed coded
+    bits.  Output bits past the coded length of 8*octets.size inputs are 0.
+    """
+    return encode_packed_many([octets], puncturingMatrix)[0]
+
+def encode_packed_many(frames, puncturingMatrix=(1,1)):
+    """
+    encode_packed for several frames in one pass; each frame is padded to a
+    whole number of puncturing periods and starts from the zero state.
+    """
+    tables, offsets, group_octets = _punctured_encoder_tables(puncturingMatrix)
+    P = len(tables)
+    sizes = np.array([f.size for f in frames], int)
+    groups = -(-sizes//P)
+    bounds = np.r_[0, np.cumsum(groups)] * P
+    padded = np.zeros(bounds[-1], np.uint8)
+    for f, b in zip(frames, bounds):
+        padded[b:b+f.size] = f
+    state = np.r_[np.uint8(0), padded[:-1]] >> 2
+    state[bounds[:-1][sizes > 0]] = 0
+    words = np.zeros(padded.size//P, np.uint64)
+    for g in range(P):
+        words |= tables[g][state[g::P], padded[g::P]] << np.uint64(offsets[g])
+    coded = words.astype('<u8').view(np.uint8).reshape(-1, 8)[:,:group_octets].ravel()
+    outputs = []
+    for n, b in zip(sizes, bounds // P * group_octets):
+        nbits = n//P * 8*group_octets + sum(offsets[g+1]-offsets[g] for g in range(n%P))
+        output = coded[b:b+(nbits+7)//8]
+        if nbits % 8:
+            output[-1] &= (1 << nbits % 8) - 1 # drop bits coded from the padding
+        outputs.append(output)
+    return outputs
+
 def encode(y):
+    return np.unpackbits(encode_packed(np.packbits(y, bitorder='little')), count=2*y.size, bitorder='little')
+
+def encode_reference(y):
     return kernels.encode(y, output_map)
 
+def quantize(llr):
+    return np.clip(llr, -llr_max, llr_max).round().astype(np.int8)
+
 def decode(llr):
     N = llr.size//2
-    return kernels.decode(N, (llr[:N*2].reshape(-1,2,1)*output_map_soft).sum(1))
+    return kernels.decode(N, quantize(llr[:N*2]), output_map)
+
+_executor = None
+
+def _decode_window(llr, start, stop, overlap):
+    # warm up from an unknown state before start, and trace back from the
+    # best state some distance after stop; the first window starts from the
+    # encoder's zero state instead
+    N = llr.size//2
+    a, b = max(start-overlap, 0), min(stop+overlap, N)
+    metrics = np.zeros(64, np.int16)
+    if a == 0:
+        # far below anything reachable from state 0, and far from the floor
+        # of int16
+        metrics[1:] = -(1 << 14)
+    decisions = np.empty(b-a, np.uint64)
+    kernels.acs(llr[a*2:b*2], output_map, metrics, decisions)
+    state = 0 if b == N else int(metrics.argmax())
+    return kernels.traceback(decisions, state)[start-a:stop-a]
+
+def decode_parallel(llr, window=2048, overlap=96, executor=None):
+    """
+    Decode a long frame as overlapping windows on a thread pool.  The kernels
+    release the GIL, so the windows run concurrently.
+    """
+    global _executor
+    if executor is None:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor()
+        executor = _executor
+    llr = quantize(llr[:llr.size//2*2])
+    N = llr.size//2
+    starts = range(0, N, window)
+    parts = executor.map(lambda start: _decode_window(llr, start, min(start+window, N), overlap), starts)
+    return np.concatenate([np.zeros(0, np.uint8)] + list(parts))
+
+def decode_reference(llr):
+    N = llr.size//2
+    return kernels.decode_reference(N, (llr[:N*2].reshape(-1,2,1)*output_map_soft).sum(1, float))
+
+class StreamingDecoder:
+    """
+    Sliding-window Viterbi decoder.  Soft bits may arrive in pieces of any
+    size; process() returns the bits that are already settled, lagging the
+    input by traceback_depth trellis steps, and flush() returns the rest
+    assuming the encoder was terminated in the zero state.
+    """
+    def __init__(self, traceback_depth=96):
+        self.traceback_depth = traceback_depth
+        self.metrics = np.zeros(64, np.int16)
+        self.reset()
+    def reset(self):
+        self.metrics[:] = 0
+        self.decisions = np.zeros(0, np.uint64)
+        self.llr = np.zeros(0, np.int8)
+    def process(self, llr):
+        llr = np.r_[self.llr, quantize(llr)]
+        N = llr.size//2
+        self.llr = llr[N*2:]
+        decisions = np.empty(N, np.uint64)
+        kernels.acs(llr, output_map, self.metrics, decisions)
+        self.decisions = np.r_[self.decisions, decisions]
+        settled = self.decisions.size - self.traceback_depth
+        if settled <= 0:
+            return np.zeros(0, np.uint8)
+        bits = kernels.traceback(self.decisions, int(self.metrics.argmax()))[:settled]
+        self.decisions = self.decisions[settled:]
+        return bits
+    def flush(self):
+        bits = kernels.traceback(self.decisions, 0)
+        self.decisions = self.decisions[:0]
+        return bits
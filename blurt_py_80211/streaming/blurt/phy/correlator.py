@@ -1,52 +1,216 @@
+import math
 import numpy as np
 from . import ofdm
+from .ring import History
+from .precision import single
+
+def sliding_max(x, w):
+    """
+    max(x[j:j+w]) for each j, from running maxima forward and backward through
+    blocks of w (van Herk / Gil-Werman), so the cost does not depend on w.
+    """
+    n = x.size
+    if n < w:
+        return x[:0]
+    blocks = np.empty(-(-n // w) * w)
+    blocks[:n] = x
+    blocks[n:] = -np.inf
+    blocks = blocks.reshape(-1, w)
+    forward = np.maximum.accumulate(blocks, 1).ravel()
+    backward = np.maximum.accumulate(blocks[:,::-1], 1)[:,::-1].ravel()
+    return np.maximum(backward[:n-w+1], forward[w-1:n])
 
 class Autocorrelator:
-    def __init__(self, nChannelsPerFrame, quantum, width):
-        self.y_hist = np.zeros((0, nChannelsPerFrame))
+    """
+    Yields, for each quantum, the autocorrelation at a lag of one quantum
+    summed over a window of width quanta, and the energy over the same span.
+    Their ratio is the Schmidl-Cox timing metric, which lies in [0, 1].
+
+    Each quantum is reduced once, when it completes; only the last quantum,
+    any partial one and the last few per-quantum terms are carried over.
+    """
+    def __init__(self, nChannelsPerFrame, quantum, width, precision=single):
+        self.samples = History((nChannelsPerFrame,), precision.complex)
+        self.terms = History((2,))
         self.nChannelsPerFrame = nChannelsPerFrame
         self.quantum = quantum
         self.width = width
+        self.quanta = 0
     def process(self, y):
-        y = np.r_[self.y_hist, y]
-        count_needed = y.shape[0] // self.quantum * self.quantum
-        count_consumed = count_needed - self.quantum * self.width
-        if count_consumed <= 0:
-            self.y_hist = y
-        else:
-            self.y_hist = y[count_consumed:]
-            y = y[:count_needed].reshape(-1, self.quantum, self.nChannelsPerFrame)
-            corr_sum = np.abs((y[:-1].conj() * y[1:]).sum(1)).cumsum(0)
-            yield (corr_sum[self.width-1:] - corr_sum[:-self.width+1]).mean(-1)
+        y = self.samples.extend(y)
+        prev = self.quantum if self.quanta else 0
+        m = (y.shape[0] - prev) // self.quantum
+        if m == 0:
+            return
+        self.samples.keep(self.quantum + (y.shape[0] - prev) % self.quantum)
+        y = y[:prev + m*self.quantum].reshape(-1, self.quantum, self.nChannelsPerFrame)
+        # the correlation between the first two quanta never enters a window
+        skip = 1 if self.quanta <= 1 else 0
+        self.quanta += m
+        # terms are averaged over channels up front; that commutes with the
+        # window sums
+        energy = (abs(y)**2).sum(1).sum(-1) * (.5 / self.nChannelsPerFrame)
+        terms = self.terms.append(max(y.shape[0] - 1 - skip, 0))
+        terms[:,0] = np.abs((y[skip:-1].conj() * y[1+skip:]).sum(1)).sum(-1) / self.nChannelsPerFrame
+        terms[:,1] = energy[skip:-1] + energy[1+skip:]
+        terms = self.terms.data
+        self.terms.keep(self.width-2)
+        n = self.width - 1
+        if terms.shape[0] < n:
+            return
+        window = terms.cumsum(0)
+        window[n:] -= window[:-n]
+        yield window[n-1:,0], window[n-1:,1]
 
 class PeakDetector:
+    """
+    Yields local maxima of a stream of values: an index is a peak when no
+    value within l before it is as large and none within l after it is
+    larger.  Peaks are reported once the l values after them have arrived.
+    """
     def __init__(self, l, quantum):
-        self.y_hist = np.zeros(l)
+        self.history = History((2,))
+        self.history.extend(np.zeros((l, 2)))
         self.l = l
-        self.i = 1
         self.quantum = quantum
-    def process(self, y):
-        y = np.r_[self.y_hist, y]
-        count_needed = y.size
-        count_consumed = count_needed - 2*self.l
-        if count_consumed <= 0:
-            self.y_hist = y
-        else:
-            self.y_hist = y[count_consumed:]
-            stripes_shape = (2*self.l+1, count_needed-2*self.l)
-            stripes_strides = (y.strides[0],)*2
-            stripes = np.lib.stride_tricks.as_strided(y, stripes_shape, stripes_strides)
-            yield from ((stripes.argmax(0) == self.l).nonzero()[0] + self.i) * self.quantum
-            self.i += count_consumed
+    def process(self, y, v=None):
+        # yields (position, v at that index) for each peak; v defaults to y
+        if v is None:
+            v = y
+        k = self.history.k - self.l + 1
+        z = self.history.append(y.size)
+        z[:,0] = y
+        z[:,1] = v
+        z = self.history.data
+        self.history.keep(2*self.l)
+        l, n = self.l, z.shape[0]
+        if n <= 2*l:
+            return
+        x = z[:,0]
+        M = sliding_max(x, l)
+        peaks = ((x[l:n-l] > M[:n-2*l]) & (x[l:n-l] >= M[l+1:])).nonzero()[0] + l
+        yield from zip((peaks + k) * self.quantum, z[peaks,1].copy())
+
+def gaussian_tail_threshold(p):
+    """The k for which a standard normal exceeds k with probability p."""
+    lo, hi = -10., 10.
+    for i in range(60):
+        k = .5 * (lo + hi)
+        lo, hi = (k, hi) if .5 * math.erfc(k / 2**.5) > p else (lo, k)
+    return k
+
+class NoiseFloor:
+    """
+    Running mean and variance of the timing metric while no frame is
+    present.  Values above the current threshold are left out so that
+    frames do not raise the floor.  The threshold sits k standard
+    deviations above the mean, with k set by the false alarm target, but
+    never above ceiling, so a clean preamble gets through even when the floor
+    was learned from nothing but frames.  Until warmup values have been seen
+    it is 0, letting every peak through.
+    """
+    def __init__(self, false_alarm_rate, time_constant, warmup, ceiling):
+        self.k = gaussian_tail_threshold(false_alarm_rate)
+        self.ceiling = ceiling
+        self.time_constant = time_constant
+        self.warmup = warmup
+        self.count = 0
+        self.mean = 0.
+        self.mean_square = 0.
+    @property
+    def threshold(self):
+        if self.count < self.warmup:
+            return 0.
+        return min(self.mean + self.k * max(self.mean_square - self.mean**2, 0.)**.5, self.ceiling)
+    def update(self, metric):
+        if self.count >= self.warmup:
+            metric = metric[metric <= self.threshold]
+        if not metric.size:
+            return
+        self.count += metric.size
+        w = 1 - (1 - 1 / min(self.count, self.time_constant)) ** metric.size
+        self.mean += w * (metric.mean() - self.mean)
+        self.mean_square += w * ((metric**2).mean() - self.mean_square)
 
 class Clause18Detector(PeakDetector):
-    def __init__(self, nChannelsPerFrame, oversample):
+    """
+    Finds peaks in the short training sequence autocorrelation, then keeps
+    only those whose normalized metric clears the adaptive noise floor.  With
+    confirm_lts, a candidate must also correlate with the long training
+    sequence where it should appear before a decoder is started.
+
+    Counters: peaks (local maxima), detections (cleared the noise floor) and
+    confirmed (handed on to a decoder).
+    """
+    def __init__(self, nChannelsPerFrame, oversample, false_alarm_rate=1e-4, time_constant=4096,
+                 warmup=256, ceiling=.75, confirm_lts=False, lts_threshold=.5, precision=single):
         N_sts_period = ofdm.L.nfft // 4
         N_sts_samples = ofdm.L.ts_reps * (ofdm.L.ncp + ofdm.L.nfft)
         quantum = N_sts_period * oversample
         width = N_sts_samples // N_sts_period
-        self.ac = Autocorrelator(nChannelsPerFrame, quantum, width)
+        self.ac = Autocorrelator(nChannelsPerFrame, quantum, width, precision)
+        self.floor = NoiseFloor(false_alarm_rate, time_constant, warmup, ceiling)
+        self.confirm_lts = confirm_lts
+        self.lts_threshold = lts_threshold
+        self.oversample = oversample
+        # where the first LTS symbol should start relative to a detection,
+        # and how far either side of that to look for it
+        self.lts_offset = (N_sts_samples + ofdm.L.ncp * ofdm.L.ts_reps) * oversample
+        self.lts_radius = ofdm.L.trainingSearchRadius * oversample
+        self.lts_template = np.fft.ifft(ofdm.L.lts_freq).conj()
+        self.lts_energy = (abs(self.lts_template)**2).sum()
+        # peaks are reported at most this many samples behind the input
+        self.lag = (2*9 + width + 2) * quantum
+        self.samples = None
+        self.pending = []
+        self.peaks = 0
+        self.detections = 0
+        self.confirmed = 0
         super().__init__(9, quantum)
     def process(self, y):
-        for a in self.ac.process(y):
-            yield from super().process(a)
+        if self.confirm_lts:
+            if self.samples is None:
+                self.samples = History(y.shape[1:], y.dtype)
+            self.samples.extend(y)
+        for corr, energy in self.ac.process(y):
+            metric = corr / np.maximum(energy, np.finfo(float).tiny)
+            threshold = self.floor.threshold
+            self.floor.update(metric)
+            # peaks are found in the raw autocorrelation so that they land
+            # where decoders expect them; the metric at each peak gates it
+            for peak, value in super().process(corr, metric):
+                self.peaks += 1
+                if value <= threshold:
+                    continue
+                self.detections += 1
+                if self.confirm_lts:
+                    self.pending.append(peak)
+                else:
+                    self.confirmed += 1
+                    yield peak
+        if self.confirm_lts:
+            yield from self.confirm()
+    def confirm(self):
+        k_end = self.samples.k + len(self.samples)
+        t = self.lts_template
+        pending = []
+        for peak in self.pending:
+            start = peak + self.lts_offset - self.lts_radius
+            stop = peak + self.lts_offset + self.lts_radius + t.size * self.oversample
+            if stop > k_end:
+                pending.append(peak)
+                continue
+            y = self.samples.data[max(start-self.samples.k, 0):stop-self.samples.k:self.oversample]
+            score = 0
+            for c in range(y.shape[1]):
+                corr = abs(np.convolve(y[:,c], t[::-1], 'valid'))
+                energy = np.convolve(abs(y[:,c])**2, np.ones(t.size), 'valid')
+                score = score + corr / np.sqrt(np.maximum(energy * self.lts_energy, np.finfo(float).tiny))
+            if (score / y.shape[1]).max() > self.lts_threshold:
+                self.confirmed += 1
+                yield peak
+        self.pending = pending
+        keep_from = k_end - self.lag
+        if pending:
+            keep_from = min(keep_from, pending[0] + self.lts_offset - self.lts_radius)
+        self.samples.keep(k_end - keep_from)
@@ -2,21 +2,53 @@
 import numpy as np
 from . import kernels
 
+def reflect(x, n):
+    """Reverse the bits in the n-bit number x."""
+    return int('{:0{}b}'.format(x, n)[::-1], 2)
+
+def as_octets(x):
+    if isinstance(x, np.ndarray):
+        return np.ascontiguousarray(x, np.uint8)
+    return np.frombuffer(x, np.uint8)
+
 class CRC:
-    def __init__(self, M, G, crc_pass, L=16):
+    """
+    Bits enter the register in transmission order, so with octets carrying
+    their bits LSB first this is a reflected CRC.  It runs a byte at a time
+    from slicing-by-8 tables, built the first time they are needed.
+    """
+    def __init__(self, M, G, crc_pass):
         self.M = M
-        self.L = L
+        self.mask = (1 << M) - 1
+        self.poly = reflect(G & self.mask, M)
         self.crc_pass = crc_pass
-        lut = np.arange(1<<L, dtype=np.uint64) << M
-        for i in range(47,31,-1): # uh...
-            lut ^= (G << (i-M)) * ((lut >> i) & 1)
-        self.lut = lut.astype(np.uint32)
+        self.residue = reflect(crc_pass, M)
+        self._tables = None
+
+    @property
+    def tables(self):
+        if self._tables is None:
+            tables = np.zeros((8, 256), np.uint32)
+            r = np.arange(256, dtype=np.uint32)
+            for i in range(8):
+                r = (r >> 1) ^ (np.uint32(self.poly) * (r & 1))
+            tables[0] = r
+            for k in range(1, 8):
+                tables[k] = (tables[k-1] >> 8) ^ tables[0][tables[k-1] & 0xff]
+            self._tables = tables
+        return self._tables
+
+    def register(self, octets):
+        octets = as_octets(octets)
+        return int(kernels.crc(octets, np.array([0, octets.size]), self.tables, self.mask)[0])
 
     def crc(self, x):
-        a = np.r_[np.ones(self.M, int), np.zeros(x.size, int)] ^ np.r_[x, np.zeros(self.M, int)]
-        a = np.r_[np.zeros(-a.size % self.L, int), a]
-        a = (a.reshape(-1, self.L) << np.arange(self.L)[::-1]).sum(1)
-        return kernels.crc(a, self.lut)
+        n = x.size // 8 * 8
+        r = self.register(np.packbits(x[:n], bitorder='little'))
+        for b in x[n:]:
+            r ^= int(b)
+            r = (r >> 1) ^ (self.poly if r & 1 else 0)
+        return reflect(r, self.M)
 
     def compute(self, x):
         return (~self.crc(x) >> np.arange(self.M)[::-1]) & 1
@@ -24,7 +56,22 @@ class CRC:
     def check(self, x):
         return self.crc(x) == self.crc_pass
 
+    # Packed variants take octets (or any bytes-like object) carrying bits LSB first.
+
+    def compute_octets(self, octets):
+        return np.frombuffer((~self.register(octets) & self.mask).to_bytes(self.M // 8, 'little'), np.uint8)
+
+    def check_octets(self, octets):
+        return self.register(octets) == self.residue
+
+    def check_many(self, frames):
+        """Check several candidate frames in one call; returns a boolean array."""
+        frames = [as_octets(f) for f in frames]
+        bounds = np.r_[0, np.cumsum([f.size for f in frames], dtype=int)]
+        data = np.concatenate(frames) if frames else np.zeros(0, np.uint8)
+        return kernels.crc(data, bounds, self.tables, self.mask) == self.residue
+
 # The FCS field is transmitted commencing with the coefficient of the highest-order term.
 CRC32_802_11_FCS = CRC(32, 0x104c11db7, 0xc704dd7b)
-CRC8_HT_SIG      = CRC(8, 0x107, 0)
-CRC16_16_2_3_7   = CRC(16, 0x11021, 0)
+CRC8_HT_SIG      = CRC(8, 0x107, 0xf3)
+CRC16_16_2_3_7   = CRC(16, 0x11021, 0x1d0f)
@@ -0,0 +1,70 @@
+import fractions
+import numpy as np
+import scipy.signal
+from .ring import History
+from .precision import single
+
+class Downconverter:
+    """
+    Mixes a real passband stream at Fc down to baseband and decimates it by
+    factor, keeping the input samples whose stream index is a multiple of
+    factor.
+
+    Only the retained outputs are computed.  The oscillator is folded into
+    the filter, taking the lowpass h to the bandpass h[k] exp(1j*Omega*k).
+    Each output is then that filter applied to the real input, multiplied by
+    exp(-1j*Omega*n) at the output rate.  The filter runs as factor-sample
+    polyphase blocks, and the output phasors come from a table whenever
+    Fc/Fs repeats within max_period outputs.  Samples are processed and
+    returned at the given precision.
+    """
+    def __init__(self, Fs, Fc, factor, nChannelsPerFrame, passband=.45, stopband=.55, attenuation=40,
+                 max_period=4096, precision=single):
+        self.factor = factor
+        self.precision = precision
+        self.nChannelsPerFrame = nChannelsPerFrame
+        self.Omega = 2*np.pi*Fc/Fs
+        # passband and stopband edges are in cycles per output sample
+        numtaps, beta = scipy.signal.kaiserord(attenuation, 2*(stopband-passband)/factor)
+        self.blocks = -(-numtaps // factor)
+        numtaps = self.blocks * factor
+        h = scipy.signal.firwin(numtaps, (passband+stopband)/factor, window=('kaiser', beta))
+        g = h * np.exp(1j*self.Omega*np.arange(numtaps))
+        # taps[j] holds the real and imaginary parts of the taps for the jth
+        # oldest block of the window, which runs oldest sample first
+        g = g[::-1].reshape(self.blocks, 1, factor)
+        self.taps = np.concatenate((g.real, g.imag), 1).astype(precision.real)
+        period = fractions.Fraction(Fc) / fractions.Fraction(Fs) * factor
+        period = period.denominator if period.denominator <= max_period else None
+        self.phasors = None if period is None else \
+            precision.phasors(-self.Omega*factor, np.arange(period))
+        # the window for output n ends on input sample n*factor, so the
+        # first windows reach back before the stream began
+        self.history = History((nChannelsPerFrame,), precision.real)
+        self.history.extend(np.zeros((self.blocks*factor - 1, nChannelsPerFrame), precision.real))
+        self.n = 0
+    def __call__(self, x):
+        factor = self.factor
+        z = self.history.extend(x)
+        n = z.shape[0] // factor - self.blocks + 1
+        self.history.keep(z.shape[0] - n*factor)
+        y = np.empty((n, self.nChannelsPerFrame), self.precision.complex)
+        if n == 0:
+            return y
+        z = z[:(n+self.blocks-1)*factor]
+        for c in range(self.nChannelsPerFrame):
+            # every block against every block of taps in one product; output
+            # n sums block n+j against taps[j] along a diagonal
+            blocks = np.ascontiguousarray(z[:,c]).reshape(-1, factor)
+            p = (self.taps.reshape(-1, factor) @ blocks.T).reshape(self.blocks, 2, -1)
+            acc = p[0,:,:n].copy()
+            for j in range(1, self.blocks):
+                acc += p[j,:,j:j+n]
+            y[:,c].real = acc[0]
+            y[:,c].imag = acc[1]
+        if self.phasors is not None:
+            y *= self.phasors[np.arange(self.n, self.n+n) % self.phasors.size][:,None]
+        else:
+            y *= self.precision.phasors(-self.Omega*factor, np.arange(self.n, self.n+n))[:,None]
+        self.n += n
+        return y
@@ -1,10 +1,15 @@
 import sys
-from typing import Tuple
+import queue
 import collections
+import traceback
+import concurrent.futures
+from typing import Tuple
 import numpy as np
 from ..graph import Port, Block
 from ..graph.typing import Array
-from . import iir
+from .downconverter import Downconverter
+from .ring import SampleRing
+from .precision import single
 
 class GenericDecoderBlock(Block):
     """
@@ -25,53 +30,161 @@ class GenericDecoderBlock(Block):
         class Decoder:
             def __init__(self, start_index, nChannelsPerFrame, oversample):
                 ...
-            def process(y, k):
+            def reset(self, start_index):
+                # Start over on a new frame, reusing this object.
+            def process(y):
+                # y holds every sample from start_index to the present, as
+                # a read-only view of the shared ring; it grows between
+                # calls.
                 # Return None for "keep going", false-ish for "decoding
                 # failed", or (datagram, snr).  Once the result is non-None,
                 # return the same result if called again.
+
+        Decoders run on an executor with workers threads (the FFT and
+        Viterbi kernels release the GIL), or on the runloop if workers is
+        0.  Each decoder has at most one call in flight, and it is called
+        again once new samples have arrived.  Completions wake the graph,
+        and datagrams are output in order of start index.
+
+        Finished decoders go back to a pool for reuse.  At most
+        max_decoders run at once.  A detection beyond that evicts the idle
+        decoder with the lowest score attribute (if decoders have one), the
+        oldest among equals, or waits for one to become idle; at most
+        max_decoders detections wait, and any more are dropped.  This also
+        bounds how far back the sample ring must reach.
+
+        A decoder whose process raises has failed on its frame: the
+        traceback is printed, its result is taken to be (), and the block
+        goes on.
+
+        outcomes counts how detections ended: 'dropped', 'evicted', 'error'
+        (process raised), or the outcome attribute of the decoder once it
+        returns a result.
+
+        The downconverter and the sample ring run at precision.
         """
         super().__init__()
         self.channel = channel
         self.intermediate_upsample = 1
+        self.lookback = 1024 # samples kept from before each buffer for late detections
+        self.max_decoders = 8
+        self.workers = None # executor default
+        self.precision = single
         self.detector_class = detector_class
         self.decoder_class = decoder_class
 
     def start(self):
         super().start()
         self.detector = self.detector_class(self.nChannelsPerFrame, self.intermediate_upsample)
-        self.decoders = []
-        self.lookback = collections.deque()
-        self.k_current = 0
-        self.k_lookback = 0
-        self.lp = iir.IIRFilter.lowpass(.45/self.channel.upsample_factor, shape=(None, self.nChannelsPerFrame), axis=0)
-        self.i = 0
+        self.decoders = {}  # decoder -> start index, in order of detection
+        self.waiting = collections.deque() # detections not yet given a decoder
+        self.busy = set()
+        self.fed = {}       # decoder -> samples.end when last called
+        self.completed = queue.Queue()
+        self.results = {}   # start index -> result, waiting for earlier frames
+        self.pool = []
+        self.outcomes = collections.Counter()
+        self.executor = None if self.workers == 0 else concurrent.futures.ThreadPoolExecutor(self.workers)
+        self.samples = SampleRing((self.nChannelsPerFrame,), self.precision.complex)
+        self.downconverter = Downconverter(self.channel.Fs, self.channel.Fc, self.channel.upsample_factor,
+                                           self.nChannelsPerFrame, precision=self.precision)
+
+    def stopped(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        super().stopped()
 
     def process(self):
-        channel = self.channel
-        Omega = 2*np.pi*channel.Fc/channel.Fs
-        upsample_factor = channel.upsample_factor
+        self.collect()
         for (y, inputTime, now), in self.iterinput():
-            nFrames = y.shape[0]
-            y = self.lp(y * np.exp(-1j*Omega * np.r_[self.i:self.i+nFrames])[:,None])
-            y = y[-self.i%upsample_factor::upsample_factor]
-            self.i += nFrames
+            y = self.downconverter(y)
+            k = self.samples.end
+            self.samples.write(y)
             for peak in self.detector.process(y):
-                d = self.decoder_class(peak, self.nChannelsPerFrame, self.intermediate_upsample)
-                k = self.k_lookback
-                for y_old in self.lookback:
-                    d.process(y_old, k)
-                    k += y_old.shape[0]
-                self.decoders.append(d)
-            self.lookback.append(y)
+                if peak < self.samples.start:
+                    continue # fell out of the lookback before it was found
+                if len(self.waiting) >= self.max_decoders:
+                    self.outcomes['dropped'] += 1
+                    continue
+                self.waiting.append(peak)
+            self.admit()
             for d in list(self.decoders):
-                result = d.process(y, self.k_current)
-                if result:
-                    print('recv psdu (%3d bytes, %2.5f dB)' % (len(result[0]), result[1]), file=sys.stderr)
-                    self.output((result,))
-                if result is not None:
-                    self.decoders.remove(d)
-            self.k_current += y.shape[0]
-            while self.lookback:
-                if self.k_lookback + self.lookback[0].shape[0] >= self.k_current - 1024:
-                    break
-                self.k_lookback += self.lookback.popleft().shape[0]
+                self.submit(d)
+            # the oldest active decoder holds back what may be overwritten
+            self.samples.release(min(list(self.decoders.values()) + list(self.waiting) + [k - self.lookback]))
+        self.deliver()
+
+    def admit(self):
+        # start decoders on waiting detections while there is room, evicting
+        # idle decoders if need be
+        while self.waiting:
+            if len(self.decoders) >= self.max_decoders:
+                idle = [d for d in self.decoders if d not in self.busy]
+                if not idle:
+                    return
+                victim = min(idle, key=lambda d: getattr(d, 'score', 0))
+                del self.decoders[victim], self.fed[victim]
+                self.pool.append(victim)
+                self.outcomes['evicted'] += 1
+            peak = self.waiting.popleft()
+            if self.pool:
+                d = self.pool.pop()
+                d.reset(peak)
+            else:
+                d = self.decoder_class(peak, self.nChannelsPerFrame, self.intermediate_upsample)
+            self.decoders[d] = peak
+            self.fed[d] = None
+            # catch up now, so that it has a score before the next detection
+            self.submit(d)
+
+    def submit(self, d):
+        if d in self.busy or d not in self.decoders or self.fed[d] == self.samples.end:
+            return
+        self.fed[d] = self.samples.end
+        y = self.samples[self.decoders[d]:self.samples.end]
+        if self.executor is None:
+            self.finish(d, *self.run(d, y))
+            return
+        self.busy.add(d)
+        def done(future, d=d):
+            self.completed.put((d, future))
+            self.notify()
+        self.executor.submit(self.run, d, y).add_done_callback(done)
+
+    def run(self, d, y):
+        # the decoder's result and outcome, read together on whichever
+        # thread it ran on
+        try:
+            result = d.process(y)
+        except Exception:
+            traceback.print_exc()
+            return (), 'error'
+        return result, getattr(d, 'outcome', None)
+
+    def collect(self):
+        while not self.completed.empty():
+            d, future = self.completed.get_nowait()
+            self.busy.discard(d)
+            self.finish(d, *future.result())
+            self.submit(d)
+        self.admit()
+
+    def finish(self, d, result, outcome):
+        if result is None:
+            return
+        self.results[self.decoders.pop(d)] = result
+        self.outcomes[outcome] += 1
+        del self.fed[d]
+        self.pool.append(d)
+
+    def deliver(self):
+        # a result goes out once no running or waiting decoder started
+        # before it
+        oldest = min(list(self.decoders.values()) + list(self.waiting), default=float('inf'))
+        for start in sorted(self.results):
+            if start >= oldest:
+                break
+            result = self.results.pop(start)
+            if result:
+                print('recv psdu (%3d bytes, %2.5f dB)' % (len(result[0]), result[1]), file=sys.stderr)
+                self.output((result,))
@@ -1,9 +1,7 @@
 import collections
-import itertools
 import numpy as np
 from ..graph import Port, Block
 from ..graph.typing import Array
-from .iir import IIRFilter
 from . import cc
 from . import rates
 from . import ofdm
@@ -12,81 +10,169 @@ from .crc import CRC32_802_11_FCS as FCS
 from . import scrambler
 from . import correlator
 from .graph_adapter import GenericDecoderBlock
+from .upconverter import Upconverter
+from .txcache import WaveformCache
+from .precision import single
 
 Channel = collections.namedtuple('Channel', ['Fs', 'Fc', 'upsample_factor'])
 
 preemphasis = -20 # dB / BW
 
+rateEncodings = {6:0xb, 9:0xf, 12:0xa, 18:0xe, 24:0x9, 36:0xd, 48:0x8, 54:0xc} # Mbps -> SIGNAL RATE
+
 ############################ OFDM ############################
 
 class Clause18Decoder:
+    """
+    Decoders are pooled: reset() starts one on a new frame while keeping
+    the buffers it has already allocated.  Its score, which decides what
+    gets evicted when too many decoders are running, is -inf until the
+    SIGNAL field checks out and then its negative dispersion.
+
+    Before training, the SIGNAL field is peeked at from a coarse grid of
+    candidate LTS positions (see OFDM.peekSignal), and the frame is
+    dropped if none of them yields a valid header.  When decoding ends,
+    outcome records how: 'early parity', 'early rate' or 'early length'
+    for the peek (what was wrong with the best candidate), then 'parity',
+    'rate', 'length', 'fcs' or 'ok'.
+
+    With several channels and combine set, they are collapsed to one stream
+    by eigen-beamforming weights from the LTS before training, so every
+    later FFT runs on a single stream.  If those flat weights would keep
+    less than combine_threshold of the per-subcarrier combining gain, as on
+    frequency-selective channels, the channels are equalized per subcarrier
+    as before.
+
+    Everything from the FFTs to the equalizer and the EKF runs at
+    precision.
+
+    A frame whose data symbols are all in hand when they are first decoded
+    (read from a capture, or after the receiver fell behind) and which
+    spans at least parallel_steps trellis steps is Viterbi decoded as
+    windows on a thread pool, with cc.decode_parallel.
+    """
     def __init__(self, i, nChannelsPerFrame, oversample):
         self.oversample = oversample
+        self.precision = single
         self.mtu = 1500
-        self.start = i
-        self.j = 0
+        self.traceback_depth = 96
+        self.parallel_steps = 4096
+        self.demap_method = 'exact'
         self.nChannelsPerFrame = nChannelsPerFrame
+        self.combine = True
+        self.combine_threshold = .9
         max_coded_bits = ((2 + self.mtu + 4) * 8 + 6) * 2
         max_data_symbols = (max_coded_bits+ofdm.L.Nsc-1) // ofdm.L.Nsc
-        max_samples = ofdm.L.N_training_samples + ofdm.L.nsym * (1 + max_data_symbols)
-        self.y = np.full((max_samples, nChannelsPerFrame), np.inf, complex)
-        self.size = 0
+        self.max_samples = ofdm.L.N_training_samples + ofdm.L.nsym * (1 + max_data_symbols)
+        self.viterbi = cc.StreamingDecoder(self.traceback_depth)
+        # demapper output for all the data symbols of the longest frame, at
+        # any rate
+        max_Ncbps = ofdm.L.Nsc * max(rates.L_rate(e).Nbpsc for e in rateEncodings.values())
+        self.demapped_buffer = np.zeros(max_data_symbols * ofdm.L.Nsc + max_Ncbps, np.int8)
+        self.reset(i)
+    @property
+    def score(self):
+        return -self.dispersion if self.j > 0 else -np.inf
+    def reset(self, i):
+        self.start = i
+        self.j = 0
+        self.peeked = False
         self.trained = False
+        self.weights = None
         self.result = None
-    def process(self, frames, k):
+        self.outcome = None
+    def reject(self, outcome):
+        self.outcome = outcome
+        self.result = ()
+        return self.result
+    def decodeSignal(self, lsig):
+        # returns the 18 SIGNAL bits, or what is wrong with them
+        # silence gives an all-zero symbol; its soft bits are then erasures
+        peak = abs(lsig.real).max()
+        lsig_llr = lsig.real * (cc.llr_max / peak) if peak > 0 else np.zeros(lsig.size)
+        SIGNAL_bits = cc.decode(rates.L_rate(0xb).deinterleave_depuncture(lsig_llr, ofdm.L.Nsc))
+        if not int(SIGNAL_bits.sum()) & 1 == 0:
+            return 'parity'
+        SIGNAL_bits = int((SIGNAL_bits[:18] << np.arange(18)).sum())
+        if rates.L_rate(SIGNAL_bits & 0xf) is None:
+            return 'rate'
+        if (SIGNAL_bits >> 5) & 0xfff > self.mtu:
+            return 'length'
+        return SIGNAL_bits
+    def streams(self, y):
+        # the samples the equalizer sees: y, or its combination
+        return y if self.weights is None else y @ self.weights
+    def process(self, y):
         if self.result is not None:
             return self.result
-        if k < self.start:
-            frames = frames[self.start-k:]
         nsym = ofdm.L.nsym
-        self.y[self.size:self.size+frames.shape[0]] = frames[:self.y.shape[0]-self.size]
-        self.size += frames.shape[0]
+        self.y = y[:self.max_samples]
+        self.size = self.y.shape[0]
+        if not self.peeked:
+            if self.size < ofdm.L.N_training_samples:
+                return
+            candidates = [self.decodeSignal(lsig) for lsig in ofdm.L.peekSignal(self.y, self.precision)]
+            if all(isinstance(SIGNAL_bits, str) for SIGNAL_bits in candidates):
+                return self.reject('early ' + candidates[0])
+            self.peeked = True
         if not self.trained:
             if self.size > ofdm.L.N_training_samples:
-                self.training_data, self.i = ofdm.L.train(self.y)
-                syms = self.y[self.i:self.i+(self.y.shape[0]-self.i)//nsym*nsym]
-                syms = syms.reshape(-1, nsym, self.nChannelsPerFrame)
-                self.syms = ofdm.L.ekfDecoder(syms, self.i, self.training_data)
+                if self.combine and self.nChannelsPerFrame > 1:
+                    weights, retained = ofdm.L.combiningWeights(self.y, self.precision)
+                    if retained >= self.combine_threshold:
+                        self.weights = weights[:,None]
+                self.training_data, self.i = ofdm.L.train(self.streams(self.y[:ofdm.L.N_training_samples]), self.precision)
+                self.ekf = ofdm.EKFDecoder(ofdm.L, self.i, self.training_data, self.precision)
                 self.trained = True
             else:
                 return
         j_valid = (self.size - self.i) // nsym
         if self.j == 0:
             if j_valid > 0:
-                lsig = next(self.syms)
-                SIGNAL_bits = cc.decode(interleave(lsig.real, ofdm.L.Nsc, 1, reverse=True))
-                if not int(SIGNAL_bits.sum()) & 1 == 0:
-                    self.result = ()
-                    return self.result
-                SIGNAL_bits = (SIGNAL_bits[:18] << np.arange(18)).sum()
+                lsig = self.ekf.process(self.streams(self.y[self.i:self.i+nsym]).reshape(1, nsym, -1))[0]
+                SIGNAL_bits = self.decodeSignal(lsig)
+                if isinstance(SIGNAL_bits, str):
+                    return self.reject(SIGNAL_bits)
                 self.rate = rates.L_rate(SIGNAL_bits & 0xf)
-                if self.rate is None:
-                    self.result = ()
-                    return self.result
-                length_octets = (SIGNAL_bits >> 5) & 0xfff
-                if length_octets > self.mtu:
-                    self.result = ()
-                    return self.result
-                self.length_coded_bits = (length_octets*8 + 16+6)*2
+                self.length_octets = (SIGNAL_bits >> 5) & 0xfff
+                # SERVICE, PSDU and tail, padded out to whole symbols; the
+                # Viterbi decoder stops at the tail, counted before puncturing
+                length_bits = 16 + self.length_octets*8 + 6
                 self.Ncbps = ofdm.L.Nsc * self.rate.Nbpsc
-                self.length_symbols = int((self.length_coded_bits+self.Ncbps-1) // self.Ncbps)
+                self.length_symbols = -(-length_bits // self.rate.Ndbps)
+                self.llr_remaining = length_bits*2
+                self.viterbi.reset()
+                self.scrambled_bits = []
                 SIGNAL_coded_bits = interleave(cc.encode((SIGNAL_bits >> np.arange(24)) & 1), ofdm.L.Nsc, 1)
                 self.dispersion = abs((lsig-(SIGNAL_coded_bits*2.-1.))**2).mean()
                 self.j = 1
             else:
                 return
-        if j_valid < self.length_symbols + 1:
+        # demodulate, demap and decode all newly available data symbols
+        # together
+        stop = min(j_valid, self.length_symbols + 1)
+        if self.j < stop:
+            whole = self.j == 1 and stop == self.length_symbols + 1
+            syms = self.streams(self.y[self.i+self.j*nsym:self.i+stop*nsym])
+            syms = self.ekf.process(syms.reshape(-1, nsym, syms.shape[1]))
+            demapped = self.demapped_buffer[:syms.size * self.rate.Nbpsc].reshape(-1, self.rate.Nbpsc)
+            self.rate.constellation[0].demap(syms, self.dispersion, demapped, self.demap_method)
+            llr = self.rate.deinterleave_depuncture(demapped, ofdm.L.Nsc)[:self.llr_remaining]
+            self.llr_remaining -= llr.size
+            if whole and llr.size >= 2*self.parallel_steps:
+                self.scrambled_bits.append(cc.decode_parallel(llr))
+            else:
+                self.scrambled_bits.append(self.viterbi.process(llr))
+            self.j = stop
+        if self.j <= self.length_symbols:
             return
-        syms = np.array(list(itertools.islice(self.syms, self.length_symbols)))
-        demapped_bits = self.rate.constellation[0].demap(syms, self.dispersion)
-        deinterleaved_bits = interleave(demapped_bits, self.Ncbps, self.rate.Nbpsc, reverse=True)
-        llr = self.rate.depuncture(deinterleaved_bits)[:self.length_coded_bits]
-        output_bits = scrambler.descramble(cc.decode(llr))[16:-6]
-        if not FCS.check(output_bits):
-            self.result = ()
-            return self.result
-        output_bytes = (output_bits[:-32].reshape(-1, 8) << np.arange(8)).sum(1)
-        self.result = output_bytes.astype(np.uint8).tostring(), 10*np.log10(1/self.dispersion)
+        self.scrambled_bits.append(self.viterbi.flush())
+        scrambled = np.packbits(np.concatenate(self.scrambled_bits), bitorder='little')
+        psdu = scrambler.descramble_octets(scrambled)[2:2+self.length_octets]
+        if not FCS.check_octets(psdu):
+            return self.reject('fcs')
+        self.outcome = 'ok'
+        self.result = psdu[:-4].tobytes(), 10*np.log10(1/self.dispersion)
         return self.result
 
 class IEEE80211aDecoderBlock(GenericDecoderBlock):
@@ -94,6 +180,19 @@ class IEEE80211aDecoderBlock(GenericDecoderBlock):
         super().__init__(channel, correlator.Clause18Detector, Clause18Decoder)
 
 class IEEE80211aEncoderBlock(Block):
+    """
+    The preamble is the same in every frame, so its passband waveform is
+    computed once for each oscillator phase it can start at and reused;
+    only the SIGNAL and data symbols are interpolated and mixed per frame.
+    encode_batch also works outside a graph, for a sink that renders frames
+    itself.
+
+    Frames the MAC hints it may resend (see WaveformCache) are kept once
+    rendered, so sending them again only copies the waveform, after enough
+    silence to bring the oscillator back to the phase it was rendered at.
+    That needs the oscillator to repeat, so nothing is cached when it
+    doesn't.
+    """
     inputs = [Port(Array[[None], np.uint8])]
     outputs = [Port(Array[[None, 'nChannelsPerFrame'], np.float32])]
 
@@ -103,45 +202,114 @@ class IEEE80211aEncoderBlock(Block):
         self.nChannelsPerFrame = nChannelsPerFrame
         self.oversample = 4
         self.preferredRate = 6
+        self.max_batch_symbols = 64
+        self.precision = single
+        self.k = 0 # LO phase
+        # the baseband waveform is oversampled, so the images of its band
+        # are far apart and a short interpolation filter will do
+        self.upconverter = Upconverter(
+            self.channel.Fs, self.channel.Fc,
+            self.channel.upsample_factor // self.oversample,
+            self.nChannelsPerFrame,
+            passband=.5/self.oversample, stopband=1-.5/self.oversample, precision=self.precision
+        )
+        self.preambles = {}
+        self.cache = WaveformCache()
 
     def start(self):
         super().start()
-        self.k = 0 # LO phase
-        self.lp = IIRFilter.lowpass(
-            0.5*self.oversample/self.channel.upsample_factor,
-            axis=0,
-            shape=(None,self.nChannelsPerFrame,)
-        )
+        self.k = 0
 
-    def process(self):
-        channel = self.channel
-        baseRate = rates.L_rate(0xb)
-        for datagram, in self.iterinput():
+    def preamble(self, k):
+        # passband preamble starting at LO phase k, cached by phase class
+        period = self.upconverter.period
+        key = None if period is None else k % period
+        if key not in self.preambles:
+            preamble = self.upconverter(ofdm.L.encodePreamble(self.oversample, self.nChannelsPerFrame, preemphasis,
+                                                              self.precision), k)
+            if key is None:
+                return preamble
+            self.preambles[key] = preamble
+        return self.preambles[key]
+
+    def encode_batch(self, datagrams, rate):
+        """
+        Passband waveforms for datagrams sent back to back at rate (in
+        Mbps), each followed by the inter-frame space.  All the frames are
+        scrambled, coded, interleaved and mapped together, and their symbols
+        go through the IFFT in a few large batches; only upconversion runs
+        frame by frame, and cached frames skip all of it.
+        """
+        factor = self.upconverter.factor
+        period = self.upconverter.period
+        oversample = self.oversample
+        rateEncoding = rateEncodings[rate]
+        keys = [None if period is None else self.cache.key(datagram, rate, self.channel) for datagram in datagrams]
+        cached = [None if key is None else self.cache.get(key) for key in keys]
+        # prepare header and payload bits
+        SIGNALs, frames = [], []
+        for datagram, entry in zip(datagrams, cached):
+            if entry is not None:
+                continue
             octets = np.frombuffer(datagram, np.uint8)
-            # prepare header and payload bits
-            rateEncoding = {6:0xb, 9:0xf, 12:0xa, 18:0xe, 24:0x9, 36:0xd, 48:0x8, 54:0xc}[self.preferredRate]
-            rate = rates.L_rate(rateEncoding)
-            data_bits = (octets[:,None] >> np.arange(8)[None,:]).flatten() & 1
-            data_bits = np.r_[np.zeros(16, int), data_bits, FCS.compute(data_bits)]
-            SIGNAL_bits = ((rateEncoding | ((octets.size+4) << 5)) >> np.arange(18)) & 1
-            SIGNAL_bits[-1] = SIGNAL_bits.sum() & 1
-            # OFDM modulation
-            scrambler_state = np.random.randint(1,127)
-            parts = (ofdm.L.subcarriersFromBits(SIGNAL_bits, baseRate, 0),
-                     ofdm.L.subcarriersFromBits(data_bits, rate, scrambler_state))
-            oversample = self.oversample
-            output = ofdm.L.encode(parts, oversample, self.nChannelsPerFrame, preemphasis)
-            # inter-frame space
-            output = np.concatenate((
-                output,
-                np.zeros((round(ofdm.L.IFS*oversample), self.nChannelsPerFrame))
-            ))
-            # upsample
-            output = self.lp(np.repeat(output, channel.upsample_factor // oversample, 0))
-            # upconvert
-            Omega = 2*np.pi*channel.Fc/channel.Fs
-            output = (output * np.exp(1j* Omega * np.r_[self.k:self.k+output.shape[0]])[:,None]).real
+            frames.append(np.r_[np.zeros(2, np.uint8), octets, FCS.compute_octets(octets)])
+            SIGNAL = rateEncoding | ((octets.size+4) << 5)
+            SIGNAL |= (bin(SIGNAL).count('1') & 1) << 17
+            SIGNALs.append(np.frombuffer(SIGNAL.to_bytes(3, 'little'), np.uint8))
+        # OFDM modulation
+        scrambler_states = np.random.randint(1, 127, len(frames))
+        hinted = [key for key, entry in zip(keys, cached) if entry is None]
+        for j, key in enumerate(hinted):
+            if key is not None:
+                scrambler_states[j] = key.seed
+        parts = [] if not frames else zip(ofdm.L.subcarriersFromOctetsBatch(SIGNALs, rates.L_rate(0xb), [0]*len(frames), [18]*len(frames)),
+                    ofdm.L.subcarriersFromOctetsBatch(frames, rates.L_rate(rateEncoding), scrambler_states))
+        # symbols are modulated in groups of whole frames, up to about
+        # max_batch_symbols at a time, which keeps the IFFT and blending in
+        # cache
+        data, group, n = [], [], 0
+        for signal, payload in parts:
+            if group and n + 1 + payload.shape[0] > self.max_batch_symbols:
+                data.extend(ofdm.L.encodeDataBatch(group, oversample, self.nChannelsPerFrame, preemphasis, self.precision))
+                group, n = [], 0
+            group.append((signal, payload))
+            n += 1 + payload.shape[0]
+        if group:
+            data.extend(ofdm.L.encodeDataBatch(group, oversample, self.nChannelsPerFrame, preemphasis, self.precision))
+        # upsample and upconvert each frame, followed by the inter-frame space
+        data = iter(data)
+        waveforms = []
+        for key, entry in zip(keys, cached):
+            if entry is not None:
+                phase, waveform = entry
+                pad = (phase - self.k) % period
+                output = np.zeros((pad + waveform.shape[0], self.nChannelsPerFrame), waveform.dtype)
+                output[pad:] = waveform
+                self.k += output.shape[0]
+                waveforms.append(output)
+                continue
+            baseband = next(data)
+            preamble = self.preamble(self.k)
+            # the data overlaps the last oversample baseband samples of the
+            # preamble, which rings on for blocks-1 more
+            i = preamble.shape[0] - (self.upconverter.blocks - 1 + oversample) * factor
+            output = np.zeros(((i // factor + baseband.shape[0] + round(ofdm.L.IFS*oversample)) * factor,
+                               self.nChannelsPerFrame), self.precision.real)
+            output[:preamble.shape[0]] = preamble
+            passband = self.upconverter(baseband, self.k + i)
+            output[i:i+passband.shape[0]] += passband
             self.k += output.shape[0]
             # crest control
             output /= abs(output).max()
-            self.output((output,))
+            if key is not None:
+                # a copy, so that nothing downstream can change what is resent
+                self.cache.put(key, (self.k - output.shape[0]) % period, output.copy())
+            waveforms.append(output)
+        return waveforms
+
+    def process(self):
+        # modulate everything queued up as one batch
+        datagrams = [datagram for datagram, in self.iterinput()]
+        if datagrams:
+            for waveform in self.encode_batch(datagrams, self.preferredRate):
+                self.output((waveform,))
@@ -1,10 +1,11 @@
 import numpy as np
 import scipy.signal
+from .precision import double
 
 class IIRFilter:
     def __init__(self, **kwargs):
         self.axis = kwargs.pop('axis', -1)
-        self.dtype = kwargs.pop('dtype', np.complex128)
+        self.dtype = kwargs.pop('dtype', kwargs.pop('precision', double).complex)
         self.shape = list(kwargs.pop('shape', (None,)))
         self.shape[self.axis] = 2
         self.shape = tuple(self.shape)
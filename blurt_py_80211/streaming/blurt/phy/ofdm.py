@@ -1,46 +1,66 @@
 #!/usr/bin/env python
+import math
 import numpy as np
 from . import scrambler
 from . import cc
 from .interleaver import interleave
+from .precision import double
 
 def estimate_cfo(y, overlap, span):
     return np.angle((y[:-overlap].conj() * y[overlap:]).sum()) / span
 
-def downconvert(y, k, Omega):
-    return y * np.exp(-1j*Omega*np.r_[k:k+y.shape[0]])[:,None]
+def downconvert(y, k, Omega, precision=double):
+    return y * precision.phasors(-Omega, np.r_[k:k+y.shape[0]])[:,None]
 
 class OFDM:
+    """
+    The encoding and decoding routines take a precision (see
+    blurt.phy.precision), which sets the dtype of the samples they produce
+    and of the FFTs, phasors and equalizers they apply.
+    """
     def __init__(self):
         self.trainingSearchRadius = 16
+        self.trainingSearchStride = 1 # > 1 for a coarse search refined around the best candidates
+        self.peekSearchStride = 4
 
-    def encodeSymbols(self, symbols, oversample, reps=1):
+    def encodeSymbols(self, symbols, oversample, reps=1, precision=double):
         assert np.ndim(symbols) == 3
         # shape of symbols should be (time, frequency, spatial stream)
         nfft = self.nfft
         ncp = self.ncp
         # stuff zeros in the middle of the frequency axis to pad it to length nfft * oversample
         zero_shape = (symbols.shape[0], nfft*(oversample-1), symbols.shape[2])
-        symbols = np.concatenate((symbols[:,:nfft//2], np.zeros(zero_shape), symbols[:,nfft//2:]), axis=1)
+        symbols = np.concatenate((symbols[:,:nfft//2], np.zeros(zero_shape, precision.complex), symbols[:,nfft//2:]), axis=1)
         # perform ifft
-        symbols = np.fft.ifft(symbols, axis=1)*oversample
+        symbols = precision.ifft(symbols, axis=1) * precision.real(oversample)
         # perform cyclic extension
-        num_tiles = (ncp*reps-1) // nfft + reps + 2
         zero_pos = ((ncp*reps-1) // nfft + 1) * nfft
         start = zero_pos - ncp * reps
         stop = zero_pos + nfft * reps + 1
-        return np.tile(symbols, (1,num_tiles,1))[:,start*oversample:stop*oversample]
+        return symbols[:,np.arange(start*oversample, stop*oversample) % (nfft*oversample)]
 
-    def blendSymbols(self, subsequences, oversample):
+    def blendSymbols(self, subsequences, oversample, precision=double):
+        if isinstance(subsequences, np.ndarray):
+            # equal lengths, as from one call to encodeSymbols: overlap-add
+            # them all at once
+            n, length, Nss = subsequences.shape
+            step = length - oversample
+            ramp = np.linspace(0,1,2+oversample)[1:-1,None].astype(precision.real)
+            output = np.zeros(((n+1)*step, Nss), precision.complex)
+            body = output[:n*step].reshape(n, step, Nss)
+            body[:] = subsequences[:,:step]
+            body[:,:oversample] *= ramp
+            output[step:].reshape(n, step, Nss)[:,:oversample] += subsequences[:,step:] * ramp[::-1]
+            return output[:n*step+oversample]
         assert all(np.ndim(ss) == 2 for ss in subsequences)
         Nss = subsequences[0].shape[1]
         assert all(ss.shape[1] == Nss for ss in subsequences)
         duration = sum(map(len, subsequences)) - (len(subsequences) - 1) * oversample
-        output = np.zeros((duration, Nss), complex)
+        output = np.zeros((duration, Nss), precision.complex)
         i = 0
         ramp = np.linspace(0,1,2+oversample)[1:-1]
         for x in subsequences:
-            weight = np.ones(x.shape[0])
+            weight = np.ones(x.shape[0], precision.real)
             weight[-1:-oversample-1:-1] = weight[:oversample] = ramp
             output[i:i+len(x)] += weight[:,None] * x
             i += len(x) - oversample
@@ -58,18 +78,120 @@ class OFDM:
     def N_training_samples(self):
         return self.N_sts_samples + self.ts_reps * self.nsym + self.trainingSearchRadius + self.nsym # include SIGNAL frame
 
-    def train(self, y):
+    @property
+    def N_signal_samples(self):
+        return self.N_sts_samples + self.ncp * self.ts_reps + self.nfft * self.ts_reps + self.nsym
+
+    def estimateCFO(self, y, precision=double):
+        # coarse from the short training sequence, then fine from the long
+        nfft = self.nfft
+        N_sts_period = nfft // 4
+        Omega = estimate_cfo(y[:self.N_sts_samples], N_sts_period, N_sts_period)
+        i = self.N_sts_samples + self.ncp*self.ts_reps
+        lts = precision.fft(downconvert(y[i:i+nfft*self.ts_reps], i, Omega, precision).reshape(-1, nfft, y.shape[1]), axis=1)
+        return Omega + estimate_cfo(lts * (self.lts_freq != 0)[:,None], 1, nfft)
+
+    def wienerFilters(self, y, Omega, offsets, precision=double):
+        # equalizer, equalized SIGNAL symbol and its SNR for every candidate
+        # LTS offset at once
         nfft = self.nfft
         ncp = self.ncp
         ts_reps = self.ts_reps
-        N_sts_samples = self.N_sts_samples
-        N_sts_period = nfft // 4
         Nss = y.shape[1]
-        i = 0
-        Omega = estimate_cfo(y[i:i+N_sts_samples], N_sts_period, N_sts_period)
-        i += N_sts_samples + ncp*ts_reps
-        lts = np.fft.fft(downconvert(y[i:i+nfft*ts_reps], i, Omega).reshape(-1, nfft, Nss), axis=1)
-        Omega += estimate_cfo(lts * (self.lts_freq != 0)[:,None], 1, nfft)
+        # train (lts symbols)
+        t = offsets[:,None] + np.arange(nfft*ts_reps)
+        lts = precision.fft((y[t] * precision.phasors(-Omega, t)[:,:,None]).reshape(-1, ts_reps, nfft, Nss), axis=2)
+        X = self.lts_freq[:,None].astype(precision.real)
+        Y = lts.sum(1)
+        if Nss == 1:
+            YY = (abs(lts)**2).sum(1)[...,None]
+            YY_inv = np.divide(1, YY, out=np.zeros_like(YY), where=YY>0)
+        else:
+            YY = (lts[:,:,:,:,None] * lts[:,:,:,None,:].conj()).sum(1)
+            YY_inv = np.linalg.pinv(YY, 1e-3, hermitian=True)
+        G = np.einsum('ij,nik,nikl->nijl', X, Y.conj(), YY_inv)
+        # test (SIGNAL symbol)
+        t = offsets[:,None] + nfft*ts_reps + ncp + np.arange(nfft)
+        Y = precision.fft(y[t] * precision.phasors(-Omega, t-ncp)[:,:,None], axis=1)
+        Xhat = np.einsum('nijk,nik->nij', G, Y)
+        X = np.sign(Xhat.real)
+        snr = Nss/np.maximum((abs(Xhat - X)**2).mean((1,2)), np.finfo(precision.real).tiny)
+        return snr, G, Xhat
+
+    def peekSignal(self, y, precision=double):
+        """
+        SIGNAL symbol data subcarriers for every peekSearchStride-th
+        candidate LTS offset of the training search, best SNR first, each
+        equalized from its own LTS and phase corrected from the pilots.
+        This needs N_training_samples and a fraction of the FFTs of
+        train(), so a header can be checked before paying for it.  Near the
+        noise floor the header often decodes at only a few offsets, and not
+        always at the one with the highest SNR, so it should be taken as
+        valid if any of them yields a valid one.
+        """
+        Omega = self.estimateCFO(y, precision)
+        i = self.N_sts_samples + self.ncp*self.ts_reps
+        radius = self.trainingSearchRadius
+        snr, G, Xhat = self.wienerFilters(y, Omega, np.arange(i-radius, i+radius, self.peekSearchStride), precision)
+        syms = Xhat[np.argsort(-snr)].sum(-1)
+        pilots = (syms[:,self.pilotSubcarriers] * self.pilotTemplate).sum(1) * (1. - 2.*scrambler.pilot_sequence[0])
+        return syms[:,self.dataSubcarriers] * (pilots.conj() / np.maximum(abs(pilots), np.finfo(float).tiny))[:,None]
+
+    def combiningWeights(self, y, precision=double):
+        """
+        Weights w collapsing the channels of y to the single stream y @ w
+        with the most preamble energy (eigen-beamforming), taken from the
+        principal eigenvector of the spatial covariance of the per-subcarrier
+        LTS channel estimates.  Also returns the fraction of the energy that
+        per-subcarrier maximal-ratio combining would collect which this one
+        flat weight keeps; it falls as the channels become frequency
+        selective in different ways.
+        """
+        nfft = self.nfft
+        i = self.N_sts_samples + self.ncp*self.ts_reps
+        lts = precision.fft(downconvert(y[i:i+nfft*self.ts_reps], i, self.estimateCFO(y, precision), precision)
+                            .reshape(-1, nfft, y.shape[1]), axis=1)
+        H = lts * self.lts_freq[:,None].astype(precision.real)
+        # the spread between repetitions is noise; take out its share of the
+        # covariance of their mean
+        N = H - H.mean(0)
+        H = H.mean(0)
+        R = H.T @ H.conj() - np.einsum('rfa,rfb->ab', N, N.conj()) / (self.ts_reps * (self.ts_reps - 1))
+        eigenvalues, eigenvectors = np.linalg.eigh(R)
+        eigenvalues = np.maximum(eigenvalues, 0)
+        return eigenvectors[:,-1].conj(), eigenvalues[-1] / max(eigenvalues.sum(), np.finfo(float).tiny)
+
+    def train(self, y, precision=double):
+        nfft = self.nfft
+        ts_reps = self.ts_reps
+        Omega = self.estimateCFO(y, precision)
+        i = self.N_sts_samples + self.ncp*ts_reps
+        def wienerFilters(offsets):
+            return self.wienerFilters(y, Omega, offsets, precision)[:2]
+        radius, stride = self.trainingSearchRadius, self.trainingSearchStride
+        offsets = np.arange(i-radius, i+radius, stride)
+        snr, G = wienerFilters(offsets)
+        if stride > 1:
+            # The SNR plateaus over the cyclic prefix, so its peak may sit
+            # next to any coarse candidate on the plateau; refine around all
+            # those within 3 dB of the best.
+            near = offsets[snr >= snr.max() / 2]
+            fine = np.unique((near[:,None] + np.arange(1-stride, stride)).ravel())
+            fine = fine[(fine >= i-radius) & (fine < i+radius) & ((fine - (i-radius)) % stride != 0)]
+            snr_fine, G_fine = wienerFilters(fine)
+            offsets, snr, G = np.r_[offsets, fine], np.r_[snr, snr_fine], np.concatenate((G, G_fine))
+        best = snr.argmax()
+        return self.trainingData(y, Omega, snr[best], offsets[best] + nfft*ts_reps, G[best])
+
+    def train_reference(self, y):
+        # one candidate LTS offset at a time, as train() did before it was
+        # batched
+        nfft = self.nfft
+        ncp = self.ncp
+        ts_reps = self.ts_reps
+        Nss = y.shape[1]
+        Omega = self.estimateCFO(y)
+        i = self.N_sts_samples + ncp*ts_reps
         def wienerFilter(i):
             # train (lts symbols)
             lts = np.fft.fft(downconvert(y[i:i+nfft*ts_reps], i, Omega).reshape(-1, nfft, Nss), axis=1)
@@ -85,8 +207,17 @@ class OFDM:
             X = np.sign(Xhat.real)
             snr = Nss/(abs(Xhat - X)**2).mean()
             return snr, i, G
-        snr, i, G = max(map(wienerFilter, range(i-self.trainingSearchRadius, i+self.trainingSearchRadius)))
-        i_sts_start = i - ncp*ts_reps - N_sts_samples
+        radius = self.trainingSearchRadius
+        snr, i, G = max(map(wienerFilter, range(i-radius, i+radius)), key=lambda candidate: candidate[0])
+        return self.trainingData(y, Omega, snr, i, G)
+
+    def trainingData(self, y, Omega, snr, i, G):
+        # the EKF's starting uncertainties, given the equalizer G chosen
+        # for LTS end i and its SIGNAL-symbol snr
+        nfft = self.nfft
+        ts_reps = self.ts_reps
+        Nss = y.shape[1]
+        i_sts_start = i - self.ncp*ts_reps - self.N_sts_samples
         i_lts_end = i + nfft*ts_reps
         var_input = y[i_sts_start:i_lts_end].var()
         var_n = var_input / (snr / Nss * self.Nsc_used / self.Nsc + 1)
@@ -96,7 +227,14 @@ class OFDM:
         var_ni = var_x/self.Nsc_used*Nss/snr
         return (G, uncertainty, var_ni, Omega), i
 
-    def ekfDecoder(self, syms, i, training_data):
+    def ekfDecoder(self, syms, i, training_data, precision=double):
+        decoder = EKFDecoder(self, i, training_data, precision)
+        for y in syms:
+            yield decoder.process(y[None])[0]
+
+    def ekfDecoder_reference(self, syms, i, training_data):
+        # one symbol at a time with matrix algebra, as ekfDecoder() did
+        # before EKFDecoder
         nsym = self.nsym
         G, uncertainty, var_ni, theta_cfo = training_data
         Np = self.pilotSubcarriers.size
@@ -123,17 +261,101 @@ class OFDM:
             u = x[0,0] - x[1,0]*1j
             yield sym[self.dataSubcarriers] * (u/abs(u))
 
-    def subcarriersFromBits(self, bits, rate, scramblerState):
+    def subcarriersFromOctets(self, octets, rate, scramblerState, nbits=None):
+        # takes nbits (default all) bits packed LSB first into octets, zero beyond that
         # adds tail bits and any needed padding to form a full symbol; does not add SERVICE
+        return self.subcarriersFromOctetsBatch([octets], rate, [scramblerState], [nbits])[0]
+
+    def subcarriersFromOctetsBatch(self, frames, rate, scramblerStates, nbits=None):
+        # subcarriersFromOctets for several frames at one rate; they are
+        # coded in one pass, and interleaved and mapped together
+        if nbits is None:
+            nbits = [None] * len(frames)
         Ncbps = self.Nsc * rate.Nbpsc
         Nbps = Ncbps * rate.ratio[0] // rate.ratio[1]
-        pad_bits = 6 + -(bits.size + 6) % Nbps
-        scrambled = scrambler.scramble(np.r_[bits, np.zeros(pad_bits, int)], scramblerState)
-        scrambled[bits.size:bits.size+6] = 0
-        punctured = cc.encode(scrambled)[np.resize(rate.puncturingMatrix, scrambled.size*2)]
+        scrambled, counts = [], []
+        for octets, scramblerState, n in zip(frames, scramblerStates, nbits):
+            if n is None:
+                n = octets.size * 8
+            total_bits = n + 6 + -(n + 6) % Nbps
+            padded = np.zeros((total_bits + 7) // 8, np.uint8)
+            padded[:octets.size] = octets
+            padded = scrambler.scramble_octets(padded, scramblerState)
+            for i in range(n, n+6): # tail
+                padded[i//8] &= ~np.uint8(1 << i%8)
+            scrambled.append(padded)
+            counts.append(total_bits // Nbps)
+        coded = cc.encode_packed_many(scrambled, rate.puncturingMatrix)
+        punctured = np.concatenate([np.unpackbits(c, count=m * Ncbps, bitorder='little')
+                                    for c, m in zip(coded, counts)])
         interleaved = interleave(punctured, self.Nsc * rate.Nbpsc, rate.Nbpsc)
         grouped = (interleaved.reshape(-1, rate.Nbpsc) << np.arange(rate.Nbpsc)).sum(1)
-        return rate.constellation[0].symbols[grouped].reshape(-1, self.Nsc)
+        symbols = rate.constellation[0].symbols[grouped].reshape(-1, self.Nsc)
+        return np.split(symbols, np.cumsum(counts)[:-1])
+
+class EKFDecoder:
+    """
+    Demodulates OFDM symbols in batches: downconversion, FFT and equalization
+    run over every symbol given at once, and then the pilot phase tracking
+    EKF steps through the per-symbol pilot sums with scalar arithmetic.
+    State carries across calls, so symbols may be passed in as they arrive.
+    """
+    def __init__(self, ofdm, i, training_data, precision=double):
+        self.ofdm = ofdm
+        self.precision = precision
+        self.i = i
+        self.j = 0
+        self.G, uncertainty, var_ni, self.theta_cfo = training_data
+        Np = ofdm.pilotSubcarriers.size
+        sigma_noise = Np*var_ni*.5
+        sigma = sigma_noise + Np*np.sin(uncertainty)**2
+        self.P = [[sigma, 0., 0.], [0., sigma, 0.], [0., 0., uncertainty**2]]
+        self.x = [float(Np), 0., 0.]
+        self.R = sigma_noise
+        self.Q = (.1*sigma, .1*sigma, .1*uncertainty**2)
+        self.rotation = precision.phasors(-self.theta_cfo, np.arange(ofdm.nfft))
+
+    def process(self, syms):
+        # syms has shape (symbol, time, spatial stream)
+        ofdm = self.ofdm
+        n = syms.shape[0]
+        k = self.i + ofdm.ncp + ofdm.nsym * np.arange(n)
+        self.i += ofdm.nsym * n
+        y = syms[:,ofdm.ncp:] * (self.precision.phasors(-self.theta_cfo, k)[:,None] * self.rotation)[:,:,None]
+        sym = np.einsum('ijk,nik->ni', self.G, self.precision.fft(y, axis=1))
+        polarity = 1. - 2.*scrambler.pilot_sequence[(self.j + np.arange(n)) % 127]
+        pilots = (sym[:,ofdm.pilotSubcarriers] * ofdm.pilotTemplate).sum(1) * polarity
+        self.j += n
+        u = np.empty(n, self.precision.complex)
+        (re, im, theta), P, R, Q = self.x, self.P, self.R, self.Q
+        (p00, p01, p02), (_, p11, p12), (_, _, p22) = P
+        for m, pilot in enumerate(pilots.tolist()):
+            # predict: rotate by theta, P <- F P F' + Q
+            c, s = math.cos(theta), math.sin(theta)
+            f02, f12 = -s*re - c*im, c*re - s*im
+            re, im = c*re - s*im, c*im + s*re
+            a00, a01, a02 = c*p00 - s*p01 + f02*p02, c*p01 - s*p11 + f02*p12, c*p02 - s*p12 + f02*p22
+            a10, a11, a12 = s*p00 + c*p01 + f12*p02, s*p01 + c*p11 + f12*p12, s*p02 + c*p12 + f12*p22
+            p00 = c*a00 - s*a01 + f02*a02 + Q[0]
+            p01 = s*a00 + c*a01 + f12*a02
+            p11 = s*a10 + c*a11 + f12*a12 + Q[1]
+            p02, p12, p22 = a02, a12, p22 + Q[2]
+            # update from the pilot measurement of (re, im)
+            s00, s01, s11 = p00 + R, p01, p11 + R
+            det = s00*s11 - s01*s01
+            i00, i01, i11 = s11/det, -s01/det, s00/det
+            k00, k01 = p00*i00 + p01*i01, p00*i01 + p01*i11
+            k10, k11 = p01*i00 + p11*i01, p01*i01 + p11*i11
+            k20, k21 = p02*i00 + p12*i01, p02*i01 + p12*i11
+            v0, v1 = pilot.real - re, pilot.imag - im
+            re, im, theta = re + k00*v0 + k01*v1, im + k10*v0 + k11*v1, theta + k20*v0 + k21*v1
+            p00, p01, p02, p11, p12, p22 = (
+                p00 - k00*p00 - k01*p01, p01 - k00*p01 - k01*p11, p02 - k00*p02 - k01*p12,
+                p11 - k10*p01 - k11*p11, p12 - k10*p02 - k11*p12, p22 - k20*p02 - k21*p12)
+            u[m] = complex(re, -im)
+        self.x = [re, im, theta]
+        self.P = [[p00, p01, p02], [p01, p11, p12], [p02, p12, p22]]
+        return sym[:,ofdm.dataSubcarriers] * (u/abs(u))[:,None]
 
 class L(OFDM): # Legacy (802.11a) mode
     def __init__(self):
@@ -166,19 +388,41 @@ class L(OFDM): # Legacy (802.11a) mode
         i = (np.arange(self.nfft) + self.nfft//2) % self.nfft - self.nfft//2
         return y * 10**(i / self.nfft * (emphasis/20))[None,:,None]
 
-    def encode(self, parts, oversample, Nss, emphasis=0):
-        # emphasis is in units of dB (power) per bandwidth
-        signal, data = parts
-        subcarriers = np.concatenate((signal, data), axis=0)
-        pilotPolarity = np.resize(scrambler.pilot_sequence, subcarriers.shape[0])
+    def encodePreamble(self, oversample, Nss, emphasis=0, precision=double):
+        # the short and long training sequences, blended
+        parts = []
+        parts.extend(self.encodeSymbols(self.csd(self.emphasize(self.sts_freq[None,:,None], emphasis), Nss),
+                                        oversample, self.ts_reps, precision))
+        parts.extend(self.encodeSymbols(self.csd(self.emphasize(self.lts_freq[None,:,None], emphasis), Nss),
+                                        oversample, self.ts_reps, precision))
+        return self.blendSymbols(parts, oversample, precision)
+
+    def encodeData(self, parts, oversample, Nss, emphasis=0, precision=double):
+        # the SIGNAL and data symbols, blended; they overlap the end of the
+        # preamble by oversample samples
+        return self.encodeDataBatch([parts], oversample, Nss, emphasis, precision)[0]
+
+    def encodeDataBatch(self, parts, oversample, Nss, emphasis=0, precision=double):
+        # encodeData for several frames, with one IFFT over all their symbols
+        subcarriers = [np.concatenate((signal, data), axis=0) for signal, data in parts]
+        counts = [sc.shape[0] for sc in subcarriers]
+        subcarriers = np.concatenate(subcarriers)
+        pilotPolarity = np.concatenate([np.resize(scrambler.pilot_sequence, n) for n in counts])
         symbols = np.zeros((subcarriers.shape[0], self.nfft), complex)
         symbols[:,self.dataSubcarriers] = subcarriers
         symbols[:,self.pilotSubcarriers] = self.pilotTemplate * (1. - 2.*pilotPolarity)[:,None]
-        parts = []
-        parts.extend(self.encodeSymbols(self.csd(self.emphasize(self.sts_freq[None,:,None], emphasis), Nss), oversample, self.ts_reps))
-        parts.extend(self.encodeSymbols(self.csd(self.emphasize(self.lts_freq[None,:,None], emphasis), Nss), oversample, self.ts_reps))
-        parts.extend(self.encodeSymbols(self.csd(self.emphasize(symbols[:,:,None], emphasis), Nss), oversample))
-        return self.blendSymbols(parts, oversample)
+        symbols = self.encodeSymbols(self.csd(self.emphasize(symbols[:,:,None], emphasis), Nss), oversample, 1, precision)
+        return [self.blendSymbols(s, oversample, precision) for s in np.split(symbols, np.cumsum(counts)[:-1])]
+
+    def encode(self, parts, oversample, Nss, emphasis=0, precision=double):
+        # emphasis is in units of dB (power) per bandwidth
+        preamble = self.encodePreamble(oversample, Nss, emphasis, precision)
+        data = self.encodeData(parts, oversample, Nss, emphasis, precision)
+        i = preamble.shape[0] - oversample
+        output = np.zeros((i + data.shape[0], Nss), precision.complex)
+        output[:preamble.shape[0]] = preamble
+        output[i:] += data
+        return output
 
 class HT20(L): # High Throughput 20 MHz bandwidth
     def __init__(self, short_GI=False):
@@ -0,0 +1,24 @@
+import typing
+import numpy as np
+import scipy.fft
+
+class Precision(typing.NamedTuple):
+    """
+    The dtypes samples are kept and processed in.  The streaming blocks
+    default to single, which halves the memory traffic of every buffer,
+    FFT and product on the sample path; the OFDM routines default to double
+    for offline analysis.
+    """
+    real: type
+    complex: type
+    def fft(self, x, axis=-1):
+        # np.fft always computes in double; scipy.fft keeps single
+        return scipy.fft.fft(np.asarray(x, self.complex), axis=axis)
+    def ifft(self, x, axis=-1):
+        return scipy.fft.ifft(np.asarray(x, self.complex), axis=axis)
+    def phasors(self, Omega, k):
+        # exp(1j*Omega*k), with the phase worked out in double
+        return np.exp(1j*Omega*np.asarray(k, float)).astype(self.complex)
+
+single = Precision(np.float32, np.complex64)
+double = Precision(np.float64, np.complex128)
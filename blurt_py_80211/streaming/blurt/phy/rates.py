@@ -1,55 +1,160 @@
 import numpy as np
 from .ofdm import L, HT20_400ns, HT20_800ns, HT40_400ns, HT40_800ns
+from .interleaver import interleave
 
-class QAM:
+def _readonly(a):
+    a = np.array(a)
+    a.flags.writeable = False
+    return a
+
+class _Frozen:
+    """Descriptors are built once, shared, and never modified."""
+    __slots__ = ()
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+    def _init(self, **kwargs):
+        for name, value in kwargs.items():
+            object.__setattr__(self, name, value)
+
+class QAM(_Frozen):
+    """
+    Square Gray-coded constellation.  The low half of each symbol's bits
+    selects the in-phase level and the high half the quadrature level, so
+    soft demapping separates into two PAM problems.
+    """
+    __slots__ = ('Nbpsc', 'symbols', 'bit_sets', 'levels', 'level_sets', 'spacing', 'linear_terms')
     def __init__(self, Nbpsc):
-        self.Nbpsc = Nbpsc
         if Nbpsc == 1:
-            self.symbols = np.array([-1,1])
+            levels = np.array([-1.,1.])
+            symbols = levels
+            spacing = 1.
         else:
             n = Nbpsc//2
             grayRevCode = sum(((np.arange(1<<n) >> i) & 1) << (n-1-i) for i in range(n))
             grayRevCode ^= grayRevCode >> 1
             grayRevCode ^= grayRevCode >> 2
-            symbols = (2*grayRevCode+1-(1<<n)) * (1.5 / ((1<<Nbpsc) - 1))**.5
-            self.symbols = np.tile(symbols, 1<<n) + 1j*np.repeat(symbols, 1<<n)
-    def demap(self, y, dispersion):
+            spacing = (1.5 / ((1<<Nbpsc) - 1))**.5
+            levels = (2*grayRevCode+1-(1<<n)) * spacing
+            symbols = np.tile(levels, 1<<n) + 1j*np.repeat(levels, 1<<n)
+        # bit_sets[i,b] lists the symbols whose bit i is b, and level_sets[i,b]
+        # the PAM levels whose bit i is b
+        j = np.arange(1<<Nbpsc)
+        bit_sets = np.array([[np.where(((j >> i) & 1) == b)[0] for b in (0, 1)] for i in range(Nbpsc)])
+        j = np.arange(levels.size)
+        h = max(Nbpsc//2, 1)
+        level_sets = np.array([[np.where(((j >> i) & 1) == b)[0] for b in (0, 1)] for i in range(h)])
+        # In the piecewise-linear form, each PAM bit follows sign*D_k(x), where
+        # D_0 = x and D_k = 2**(h-k)*spacing - |D_{k-1}|.
+        def D(x):
+            D = [x]
+            for k in range(1, h):
+                D.append(2**(h-k)*spacing - abs(D[-1]))
+            return D
+        D_levels = np.array(D(levels))
+        linear_terms = []
+        for i in range(h):
+            bit = 2*((j >> i) & 1) - 1
+            matches = [(k, sign) for k in range(h) for sign in (1, -1) if (np.sign(sign*D_levels[k]) == bit).all()]
+            linear_terms.append(matches[0])
+        self._init(Nbpsc=Nbpsc, symbols=_readonly(symbols), bit_sets=_readonly(bit_sets), levels=_readonly(levels),
+                   level_sets=_readonly(level_sets), spacing=spacing, linear_terms=tuple(linear_terms))
+    def demap(self, y, dispersion, out=None, method='exact'):
+        """
+        Soft bits 10*ln(P(1)/P(0)) for each symbol of y, shape (y.size, Nbpsc).
+        method is 'exact' (log-sum-exp over PAM levels), 'maxlog', or 'linear'
+        for the piecewise-linear closed form.  Values are rounded and saturated
+        to the range of out (e.g. an int8 or int16 buffer of that shape) if
+        given, otherwise to +/-1e4.
+        """
+        y = y.ravel()
+        axes = (y.real,) if self.Nbpsc == 1 else (y.real, y.imag)
+        # work in the precision of y
+        dtype = np.result_type(y.real.dtype, np.float32)
+        if method == 'linear':
+            llr = np.empty((y.size, len(axes), self.level_sets.shape[0]), dtype)
+            for a, x in enumerate(axes):
+                D = [x]
+                for k in range(1, llr.shape[2]):
+                    D.append(2**(llr.shape[2]-k)*self.spacing - abs(D[-1]))
+                for i, (k, sign) in enumerate(self.linear_terms):
+                    llr[:,a,i] = sign * D[k]
+            llr *= 40 * self.spacing / dispersion
+        else:
+            reduce = np.logaddexp.reduce if method == 'exact' else np.maximum.reduce
+            ll = -(np.stack(axes, 1)[:,:,None] - self.levels.astype(dtype))**2 / dispersion
+            ll = reduce(ll[:,:,self.level_sets], -1)
+            llr = 10 * (ll[...,1] - ll[...,0])
+        llr = llr.reshape(y.size, self.Nbpsc)
+        if out is None:
+            out = np.empty(llr.shape, int)
+        bound = min(np.iinfo(out.dtype).max, 1e4)
+        out[...] = np.rint(np.clip(llr, -bound, bound, out=llr))
+        return out
+    def demap_reference(self, y, dispersion):
         n = self.Nbpsc
         squared_distance = np.abs(self.symbols - y.flatten()[:,None])**2
         ll = -np.log(np.pi * dispersion) - squared_distance / dispersion
         ll -= np.logaddexp.reduce(ll, 1)[:,None]
-        j = np.arange(1<<n)
         llr = np.zeros((y.size, n), int)
         for i in range(n):
-            llr[:,i] = 10 * (np.logaddexp.reduce(ll[:,0 != (j & (1<<i))], 1) - \
-                             np.logaddexp.reduce(ll[:,0 == (j & (1<<i))], 1))
+            llr[:,i] = 10 * (np.logaddexp.reduce(ll[:,self.bit_sets[i,1]], 1) - \
+                             np.logaddexp.reduce(ll[:,self.bit_sets[i,0]], 1))
         return np.clip(llr, -1e4, 1e4)
 
-class Rate:
+_constellations = {Nbpsc: QAM(Nbpsc) for Nbpsc in (1, 2, 4, 6, 8)}
+
+_puncturing_matrices = {
+    (1,2):[1,1],
+    (2,3):[1,1,1,0],
+    (3,4):[1,1,1,0,0,1],
+    (5,6):[1,1,1,0,0,1,1,0,0,1],
+    (7,8):[1,1,1,0,1,0,1,0,0,1,1,0,0,1],
+}
+
+class Rate(_Frozen):
+    __slots__ = ('ofdm_format', 'Nbpscs', 'Nbpsc', 'constellation', 'Ncbpss', 'Ncbps', 'Ndbps',
+                 'puncturingMatrix', 'ratio', '_decoder_maps')
     def __init__(self, Nbpscs, ratio, Nss=1, ofdm_format=L):
-        self.ofdm_format = ofdm_format
-        self.Nbpscs = np.asarray(Nbpscs)
-        if np.ndim(self.Nbpscs) == 0:
-            self.Nbpscs = np.resize(self.Nbpscs, Nss)
-        self.Nbpsc = self.Nbpscs.sum()
-        self.constellation = [QAM(n) for n in self.Nbpscs]
+        Nbpscs = np.asarray(Nbpscs)
+        if np.ndim(Nbpscs) == 0:
+            Nbpscs = np.resize(Nbpscs, Nss)
+        self._init(
+            ofdm_format=ofdm_format,
+            Nbpscs=_readonly(Nbpscs),
+            Nbpsc=Nbpscs.sum(),
+            constellation=tuple(_constellations[n] for n in Nbpscs),
+            puncturingMatrix=_readonly(np.bool_(_puncturing_matrices[ratio])),
+            ratio=ratio,
+            _decoder_maps={},
+        )
         if ofdm_format is not None:
-            self.Ncbpss = ofdm_format.Nsc * self.Nbpscs
-            self.Ncbps = self.Ncbpss.sum()
-            self.Ndbps = self.Ncbps * ratio[0] // ratio[1]
-        self.puncturingMatrix = np.bool_({
-            (1,2):[1,1],
-            (2,3):[1,1,1,0],
-            (3,4):[1,1,1,0,0,1],
-            (5,6):[1,1,1,0,0,1,1,0,0,1],
-            (7,8):[1,1,1,0,1,0,1,0,0,1,1,0,0,1],
-        }[ratio])
-        self.ratio = ratio
+            Ncbpss = ofdm_format.Nsc * Nbpscs
+            self._init(Ncbpss=_readonly(Ncbpss), Ncbps=Ncbpss.sum(), Ndbps=Ncbpss.sum() * ratio[0] // ratio[1])
     def depuncture(self, y):
         output_size = (y.size + self.ratio[1]-1) // self.ratio[1] * self.ratio[0] * 2
         output = np.zeros(output_size, y.dtype)
         output[np.resize(self.puncturingMatrix, output.size)] = y
         return output
+    def decoder_map(self, Nsc):
+        """
+        Gather indices from one symbol of demapper output (Nsc*Nbpsc soft
+        bits in interleaved order, then an erasure) to Viterbi input, with
+        punctured positions pointing at the erasure.  Single stream only.
+        """
+        if Nsc not in self._decoder_maps:
+            Ncbps = Nsc * self.Nbpsc
+            HT = self.ofdm_format is not None and self.ofdm_format is not L
+            p = interleave(np.arange(Ncbps), Ncbps, self.Nbpsc, HT, Nsc > 52, reverse=True)
+            m = np.full(Ncbps // self.ratio[1] * self.ratio[0] * 2, Ncbps)
+            m[np.resize(self.puncturingMatrix, m.size)] = p
+            self._decoder_maps[Nsc] = _readonly(m)
+        return self._decoder_maps[Nsc]
+    def deinterleave_depuncture(self, y, Nsc):
+        y = y.reshape(-1, Nsc * self.Nbpsc)
+        y = np.concatenate((y, np.zeros((y.shape[0], 1), y.dtype)), 1)
+        return y.take(self.decoder_map(Nsc), 1).ravel()
 
 _l_rate_params = {
     0xb: (1, (1,2)), # BPSK (1/2)
@@ -93,18 +198,28 @@ _HT = {
     },
 }
 
+# Rates are built on first use and then shared; L rates are built up front
+# since every received SIGNAL field asks for one.
+_registry = {}
+
+def _lookup(key, build):
+    rate = _registry.get(key)
+    if rate is None:
+        rate = _registry[key] = build()
+    return rate
+
 def L_rate(encoding):
     if not encoding in _l_rate_params:
         return None
     Nbpscs, ratio = _l_rate_params[encoding]
-    return Rate(Nbpscs, ratio, 1, L)
+    return _lookup(('L', encoding), lambda: Rate(Nbpscs, ratio, 1, L))
 
 def HT_rate(bw, gi, mcs):
     if not 0 <= mcs < 31:
         return None
     Nss = mcs // 8 + 1
     Nbpscs, ratio = _ht_rate_params[mcs % 8]
-    return Rate(Nbpscs, ratio, Nss, _HT[gi][bw])
+    return _lookup(('HT', bw, gi, mcs), lambda: Rate(Nbpscs, ratio, Nss, _HT[gi][bw]))
 
 def VHT_rate(bw, gi, Nss, mcs):
     if not 0 <= mcs < 10:
@@ -112,4 +227,7 @@ def VHT_rate(bw, gi, Nss, mcs):
     if not 0 < Nss <= 8:
         return None
     Nbpscs, ratio = _vht_rate_params[mcs]
-    return Rate(Nbpscs, ratio, Nss, _HT[gi][bw])
+    return _lookup(('VHT', bw, gi, Nss, mcs), lambda: Rate(Nbpscs, ratio, Nss, _HT[gi][bw]))
+
+for encoding in _l_rate_params:
+    L_rate(encoding)
@@ -0,0 +1,83 @@
+import numpy as np
+
+class History:
+    """
+    The tail of a stream, kept contiguous in a preallocated buffer.  Input is
+    appended in place; when the buffer fills, the part still being kept is
+    moved back to the front, so each entry is copied about once however the
+    stream is chopped up.  k is the stream index of the oldest entry kept.
+    Views returned by extend are only valid until the next call.
+    """
+    def __init__(self, shape=(), dtype=float, capacity=4096):
+        self.buffer = np.zeros((capacity,) + tuple(shape), dtype)
+        self.start = self.stop = 0
+        self.k = 0
+    def __len__(self):
+        return self.stop - self.start
+    @property
+    def data(self):
+        return self.buffer[self.start:self.stop]
+    def extend(self, y):
+        self.append(y.shape[0])[...] = y
+        return self.data
+    def append(self, n):
+        """Make room for n new entries at the end and return them for filling in."""
+        if self.stop + n > self.buffer.shape[0]:
+            kept = len(self)
+            buffer = self.buffer
+            if kept + n > buffer.shape[0]:
+                buffer = np.zeros((max(2*buffer.shape[0], kept+n),) + buffer.shape[1:], buffer.dtype)
+            buffer[:kept] = self.data
+            self.buffer, self.start, self.stop = buffer, 0, kept
+        self.stop += n
+        return self.buffer[self.stop-n:self.stop]
+    def keep(self, n):
+        """Discard all but the newest n entries."""
+        n = min(n, len(self))
+        self.k += len(self) - n
+        self.start = self.stop - n
+
+class SampleRing:
+    """
+    Samples addressed by absolute stream index, shared by everything reading
+    the stream.  Each sample is written twice, capacity apart, so any span of
+    up to capacity samples is a contiguous view of the buffer whether or not
+    it wraps.  Samples before the point passed to release may be overwritten;
+    until then, views of them stay valid.  If a write would overwrite
+    samples still retained, the buffer doubles.
+    """
+    def __init__(self, shape=(), dtype=complex, capacity=1<<14):
+        self.shape = tuple(shape)
+        self.capacity = capacity
+        self.buffer = np.zeros((2*capacity,) + self.shape, dtype)
+        self.start = 0
+        self.end = 0
+    def __len__(self):
+        return self.end - self.start
+    def write(self, y):
+        n = y.shape[0]
+        if self.end + n - self.start > self.capacity:
+            capacity = self.capacity
+            while self.end + n - self.start > capacity:
+                capacity *= 2
+            retained = self[self.start:self.end]
+            self.capacity = capacity
+            self.buffer = np.zeros((2*capacity,) + self.shape, self.buffer.dtype)
+            self.end = self.start
+            self.write(retained)
+        p = self.end % self.capacity
+        self.buffer[p:p+n] = y
+        # mirror the samples that fell in one half into the other
+        m = min(n, self.capacity - p)
+        self.buffer[p+self.capacity:p+self.capacity+m] = y[:m]
+        self.buffer[:n-m] = y[m:]
+        self.end += n
+    def release(self, k):
+        """Allow samples before absolute index k to be overwritten."""
+        self.start = max(self.start, min(k, self.end))
+    def __getitem__(self, s):
+        start, stop = s.start, s.stop
+        if start < self.start or stop > self.end or start > stop:
+            raise IndexError('samples [%d, %d) are not all retained' % (start, stop))
+        p = start % self.capacity
+        return self.buffer[p:p+stop-start]
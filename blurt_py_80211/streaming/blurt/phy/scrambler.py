@@ -16,3 +16,21 @@ def scramble(bits, state):
 
 def descramble(bits):
     return scramble(bits, scrambler_state_lookup[(bits[:7] << np.arange(6,-1,-1)).sum()])
+
+# Packed sequence bank: octet k of bank[state] holds bits 8k..8k+7 of the
+# sequence from that state, LSB first.  The octet sequence repeats every 127
+# octets, and the bank is unrolled to cover an MTU-sized frame.
+period_octets = np.packbits(np.tile(scrambler, (1, 8)), axis=1, bitorder='little')
+bank = np.tile(period_octets, (1, 13))
+
+# the first seven bits of SERVICE are zero, so its first octet gives the state
+bank_state_lookup = np.zeros(128, int)
+bank_state_lookup[bank[:,0] & 0x7f] = np.arange(128)
+
+def scramble_octets(octets, state):
+    if octets.size <= bank.shape[1]:
+        return octets ^ bank[state,:octets.size]
+    return octets ^ np.resize(period_octets[state], octets.size)
+
+def descramble_octets(octets):
+    return scramble_octets(octets, bank_state_lookup[octets[0] & 0x7f])
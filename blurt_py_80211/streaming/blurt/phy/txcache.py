@@ -0,0 +1,70 @@
+import collections
+import hashlib
+import threading
+import numpy as np
+
+WaveformKey = collections.namedtuple('WaveformKey', ['digest', 'rate', 'seed', 'channel'])
+
+class WaveformCache:
+    """
+    Least recently used transmit waveforms, up to budget bytes of them.
+
+    Only PSDUs the MAC has hinted it may send again are cached.  Each is
+    given a scrambler seed when it is hinted, so every transmission of it
+    scrambles the same way and renders to the same waveform.  The most
+    recent max_hints hints are remembered.  Hints arrive from the MAC while
+    the encoder looks up and stores waveforms, so all of it is locked.
+
+    Counters: hits and misses, among lookups of hinted PSDUs.
+    """
+    def __init__(self, budget=32<<20, max_hints=1024):
+        self.budget = budget
+        self.max_hints = max_hints
+        self.nbytes = 0
+        self.entries = collections.OrderedDict() # key -> (LO phase, waveform)
+        self.seeds = collections.OrderedDict()   # digest -> scrambler seed
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(psdu):
+        return hashlib.blake2b(bytes(psdu), digest_size=16).digest()
+
+    def hint(self, psdu):
+        digest = self.digest(psdu)
+        with self.lock:
+            if digest in self.seeds:
+                self.seeds.move_to_end(digest)
+            else:
+                self.seeds[digest] = np.random.randint(1, 127)
+                if len(self.seeds) > self.max_hints:
+                    self.seeds.popitem(last=False)
+
+    def key(self, psdu, rate, channel):
+        # None unless psdu was hinted
+        digest = self.digest(psdu)
+        with self.lock:
+            seed = self.seeds.get(digest)
+        return None if seed is None else WaveformKey(digest, rate, seed, channel)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, phase, waveform):
+        if waveform.nbytes > self.budget:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1].nbytes
+            self.entries[key] = (phase, waveform)
+            self.nbytes += waveform.nbytes
+            while self.nbytes > self.budget:
+                self.nbytes -= self.entries.popitem(last=False)[1][1].nbytes
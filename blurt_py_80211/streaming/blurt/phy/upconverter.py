@@ -0,0 +1,70 @@
+import fractions
+import numpy as np
+import scipy.signal
+from .precision import single
+
+class Upconverter:
+    """
+    Interpolates a complex baseband stream by factor and mixes it up to a
+    real passband signal at Fc.
+
+    The oscillator is folded into the filter as in Downconverter, so the
+    baseband samples are mixed at their own rate and then run through the
+    bandpass h[k] exp(1j*Omega*k).  That filter is split into factor
+    polyphase branches, so only the input samples are ever multiplied,
+    never the zeros between them.  The carrier comes from a table whenever
+    Fc/Fs repeats within max_period output samples; period is then the
+    length of that table, and outputs starting at output indices congruent
+    modulo period are identical.  Samples are processed and returned at
+    the given precision.
+    """
+    def __init__(self, Fs, Fc, factor, nChannelsPerFrame, passband=.45, stopband=.55, attenuation=40,
+                 max_period=4096, precision=single):
+        self.factor = factor
+        self.precision = precision
+        self.nChannelsPerFrame = nChannelsPerFrame
+        self.Omega = 2*np.pi*Fc/Fs
+        # passband and stopband edges are in cycles per input sample
+        numtaps, beta = scipy.signal.kaiserord(attenuation, 2*(stopband-passband)/factor)
+        self.blocks = -(-numtaps // factor)
+        numtaps = self.blocks * factor
+        h = scipy.signal.firwin(numtaps, (passband+stopband)/factor, window=('kaiser', beta)) * factor
+        g = h * np.exp(1j*self.Omega*np.arange(numtaps))
+        # rows j and blocks+j of taps hold the taps for all factor phases
+        # against the real and imaginary parts of the jth oldest input in the
+        # window
+        g = g.reshape(self.blocks, factor)[::-1]
+        self.taps = np.concatenate((g.real, -g.imag)).astype(precision.real)
+        period = fractions.Fraction(Fc) / fractions.Fraction(Fs)
+        self.period = period.denominator if period.denominator <= max_period else None
+        self.phasors = None if self.period is None else \
+            precision.phasors(self.Omega, np.arange(self.period))
+    def __call__(self, x, k=0, chunk=8192):
+        """
+        Passband output for x, starting at output sample index k of the
+        oscillator, and running on until the filter has rung down, which is
+        blocks-1 input samples past the end of x.  Long inputs are filtered
+        chunk samples at a time, which keeps the working set in cache.
+        """
+        factor, blocks, nChannelsPerFrame = self.factor, self.blocks, self.nChannelsPerFrame
+        real = self.precision.real
+        n = x.shape[0] + blocks - 1
+        t = k + factor*np.arange(x.shape[0])
+        z = np.zeros((n + blocks - 1, nChannelsPerFrame), self.precision.complex)
+        z[blocks-1:n] = x
+        if self.phasors is not None:
+            z[blocks-1:n] *= self.phasors[t % self.period][:,None]
+        else:
+            z[blocks-1:n] *= self.precision.phasors(self.Omega, t)[:,None]
+        # gather the windows, as real and imaginary parts, and apply all the
+        # taps to them in one product
+        z = z.view(real).reshape(-1, nChannelsPerFrame, 2)
+        y = np.empty((n, factor, nChannelsPerFrame), real)
+        windows = np.empty((min(n, chunk), nChannelsPerFrame, 2, blocks), real)
+        for start in range(0, n, chunk):
+            stop = min(start + chunk, n)
+            w = windows[:stop-start]
+            for j in range(blocks):
+                w[...,j] = z[start+j:stop+j]
+            y[start:stop] = (w.reshape(-1, 2*blocks) @ self.taps).reshape(-1, nChannelsPerFrame, factor).transpose(0, 2, 1)
+        return y.reshape(n*factor, nChannelsPerFrame)
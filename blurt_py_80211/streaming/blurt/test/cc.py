@@ -0,0 +1,99 @@
+import numpy as np
+import blurt
+from blurt.phy import cc
+
+# The vectorized Viterbi kernel must agree bit for bit with the scalar
+# reference, including on ties (erasures) and heavily saturated input.
+np.random.seed(0)
+for trial in range(200):
+    N = np.random.randint(1, 3000)
+    bits = np.random.randint(0, 2, N)
+    bits[-6:] = 0
+    coded = cc.encode(bits) * 2. - 1.
+    scale = np.random.choice([1, 10, 60, cc.llr_max, 1000])
+    noise = np.random.choice([0., .5, 1., 2.])
+    llr = cc.quantize(scale * (coded + noise * np.random.standard_normal(coded.size)))
+    if trial % 5 == 0:
+        llr[np.random.random_sample(llr.size) < .3] = 0
+    assert (cc.decode(llr) == cc.decode_reference(llr)).all(), trial
+print('decode matches decode_reference')
+
+# Feeding the streaming decoder in arbitrary pieces should settle on the same
+# bits as decoding the whole frame at once when the channel is clean enough.
+for trial in range(50):
+    N = np.random.randint(1, 3000)
+    bits = np.random.randint(0, 2, N)
+    bits[-6:] = 0
+    llr = cc.quantize(20 * (cc.encode(bits) * 2. - 1. + .5 * np.random.standard_normal(2*N)))
+    d = cc.StreamingDecoder()
+    output, i = [], 0
+    while i < llr.size:
+        n = np.random.randint(1, 300)
+        output.append(d.process(llr[i:i+n]))
+        i += n
+    output.append(d.flush())
+    assert (np.concatenate(output) == cc.decode(llr)).all(), trial
+print('StreamingDecoder matches decode')
+
+# Pieces shorter than the kernel's renormalization interval must not let the
+# path metrics run away over a long frame.
+for trial in range(10):
+    N = 5000
+    bits = np.random.randint(0, 2, N)
+    bits[-6:] = 0
+    llr = cc.quantize(cc.llr_max * (cc.encode(bits) * 2. - 1.))
+    d = cc.StreamingDecoder()
+    output, i = [], 0
+    while i < llr.size:
+        n = np.random.randint(1, 32)
+        output.append(d.process(llr[i:i+n]))
+        i += n
+    output.append(d.flush())
+    assert (np.concatenate(output) == bits).all(), trial
+print('StreamingDecoder survives small pieces')
+
+# Likewise for the windowed decoder, whose windows run on a thread pool.
+for trial in range(20):
+    N = np.random.randint(1, 30000)
+    bits = np.random.randint(0, 2, N)
+    bits[-6:] = 0
+    llr = cc.quantize(20 * (cc.encode(bits) * 2. - 1. + .5 * np.random.standard_normal(2*N)))
+    assert (cc.decode_parallel(llr, window=np.random.randint(100, 5000)) == cc.decode(llr)).all(), trial
+print('decode_parallel matches decode')
+
+# On MTU-sized frames near and past the waterfall, the windows must lose
+# nothing against the serial decoder: every frame it recovers is recovered,
+# and the bit errors are no worse.
+N = 16 + 8*1504 + 6
+for noise in (.6, .7, 1.):
+    errors = {cc.decode: 0, cc.decode_parallel: 0}
+    for trial in range(10):
+        bits = np.random.randint(0, 2, N)
+        bits[-6:] = 0
+        llr = cc.quantize(20 * (cc.encode(bits) * 2. - 1. + noise * np.random.standard_normal(2*N)))
+        serial, parallel = cc.decode(llr), cc.decode_parallel(llr)
+        assert (parallel == bits).all() or not (serial == bits).all(), (noise, trial)
+        errors[cc.decode] += (serial != bits).sum()
+        errors[cc.decode_parallel] += (parallel != bits).sum()
+    assert errors[cc.decode_parallel] <= errors[cc.decode] * 1.02 + 10, noise
+print('decode_parallel loses nothing against decode on long noisy frames')
+
+# The byte-wise encoder must match the bit-serial kernel followed by
+# puncturing, for every rate's puncturing pattern and any input length.
+puncturingMatrices = ((1,1), (1,1,1,0), (1,1,1,0,0,1), (1,1,1,0,0,1,1,0,0,1), (1,1,1,0,1,0,1,0,0,1,1,0,0,1))
+for trial in range(200):
+    octets = np.random.randint(0, 256, np.random.randint(0, 300)).astype(np.uint8)
+    bits = np.unpackbits(octets, bitorder='little').astype(int)
+    assert (cc.encode(bits) == cc.encode_reference(bits)).all(), trial
+    m = np.array(puncturingMatrices[trial % len(puncturingMatrices)], bool)
+    punctured = cc.encode_reference(bits)[np.resize(m, bits.size*2)]
+    assert (np.unpackbits(cc.encode_packed(octets, m), count=punctured.size, bitorder='little') == punctured).all(), trial
+print('encode_packed matches encode_reference')
+
+# Encoding several frames in one pass must match encoding each on its own.
+for trial in range(50):
+    frames = [np.random.randint(0, 256, np.random.randint(0, 100)).astype(np.uint8) for i in range(np.random.randint(1, 10))]
+    m = puncturingMatrices[trial % len(puncturingMatrices)]
+    for octets, coded in zip(frames, cc.encode_packed_many(frames, m)):
+        assert np.array_equal(coded, cc.encode_packed(octets, m)), trial
+print('encode_packed_many matches encode_packed')
@@ -0,0 +1,57 @@
+import time
+import numpy as np
+import blurt
+from blurt.phy import ofdm, rates
+
+def frame(nsyms):
+    subcarriers = rates.L_rate(0xb).constellation[0].symbols[np.random.randint(0, 2, (1+nsyms, ofdm.L.Nsc))]
+    return ofdm.L.encode((subcarriers[:1], subcarriers[1:]), 1, 1)[:,0]
+
+def microphones(x, responses, snr_db):
+    y = np.array([np.convolve(x, h)[:x.size] for h in responses]).T
+    noise = np.random.standard_normal(y.shape) + 1j*np.random.standard_normal(y.shape)
+    return y + noise * (abs(x)**2).mean()**.5 * 10**(-snr_db/20) / 2**.5
+
+# On flat channels the weights are the conjugate channel gains, up to a
+# common phase, and keep nearly all of the combining gain; when each
+# microphone hears an equally loud echo at a different delay they keep
+# noticeably less.
+np.random.seed(0)
+for trial in range(20):
+    M = np.random.randint(2, 5)
+    gains = np.random.standard_normal(M) + 1j*np.random.standard_normal(M)
+    w, retained = ofdm.L.combiningWeights(microphones(frame(4), gains[:,None], 30))
+    assert retained > .95, trial
+    assert abs(w @ gains) / np.linalg.norm(w) / np.linalg.norm(gains) > .99, trial
+    responses = np.zeros((M, 16), complex)
+    responses[:,0] = np.exp(2j*np.pi*np.random.random_sample(M))
+    responses[np.arange(M),np.random.permutation(np.arange(4, 16))[:M]] = np.exp(2j*np.pi*np.random.random_sample(M))
+    w, retained = ofdm.L.combiningWeights(microphones(frame(4), responses, 30))
+    assert retained < .9, trial
+print('combining weights match the channel')
+
+# Microbenchmark: equalizing data symbols per subcarrier across every
+# microphone against combining them first.  Combining should bring the cost
+# down to about that of a single microphone, whatever M is.  Each case is
+# timed several times and the fastest run kept, since one run is at the
+# mercy of the scheduler.
+nsyms = 200
+for M in (1, 2, 4):
+    gains = np.random.standard_normal(M) + 1j*np.random.standard_normal(M)
+    y = microphones(frame(nsyms), gains[:,None], 20)
+    w = ofdm.L.combiningWeights(y)[0][:,None]
+    for combine in (False, True):
+        if combine and M == 1:
+            continue
+        training_data, i = ofdm.L.train(y @ w if combine else y)
+        # the SIGNAL symbol and every data symbol
+        n = nsyms + 1
+        dt = np.inf
+        for trial in range(20):
+            t0 = time.time()
+            z = y[i:i+n*ofdm.L.nsym]
+            if combine:
+                z = z @ w
+            ofdm.EKFDecoder(ofdm.L, i, training_data).process(z.reshape(n, ofdm.L.nsym, -1))
+            dt = min(dt, time.time() - t0)
+        print('%d microphone(s)%s: %.1f us per symbol' % (M, ', combined' if combine else '', dt / n * 1e6))
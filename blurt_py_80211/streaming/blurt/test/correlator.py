@@ -0,0 +1,210 @@
+import time
+import numpy as np
+import blurt
+from blurt.phy import correlator, ofdm, rates
+
+# The previous front end, which re-concatenated its history onto every buffer
+# and took an argmax over a (2l+1) x n strided view.
+class ReferenceAutocorrelator:
+    def __init__(self, nChannelsPerFrame, quantum, width):
+        self.y_hist = np.zeros((0, nChannelsPerFrame))
+        self.nChannelsPerFrame = nChannelsPerFrame
+        self.quantum = quantum
+        self.width = width
+    def process(self, y):
+        y = np.r_[self.y_hist, y]
+        count_needed = y.shape[0] // self.quantum * self.quantum
+        count_consumed = count_needed - self.quantum * self.width
+        if count_consumed <= 0:
+            self.y_hist = y
+        else:
+            self.y_hist = y[count_consumed:]
+            y = y[:count_needed].reshape(-1, self.quantum, self.nChannelsPerFrame)
+            corr_sum = np.abs((y[:-1].conj() * y[1:]).sum(1)).cumsum(0)
+            energy = (abs(y)**2).sum(1)
+            energy_sum = (.5 * (energy[:-1] + energy[1:])).cumsum(0)
+            yield ((corr_sum[self.width-1:] - corr_sum[:-self.width+1]).mean(-1),
+                   (energy_sum[self.width-1:] - energy_sum[:-self.width+1]).mean(-1))
+
+class ReferencePeakDetector:
+    def __init__(self, l, quantum):
+        self.y_hist = np.zeros(l)
+        self.l = l
+        self.i = 1
+        self.quantum = quantum
+    def process(self, y):
+        y = np.r_[self.y_hist, y]
+        count_needed = y.size
+        count_consumed = count_needed - 2*self.l
+        if count_consumed <= 0:
+            self.y_hist = y
+        else:
+            self.y_hist = y[count_consumed:]
+            stripes_shape = (2*self.l+1, count_needed-2*self.l)
+            stripes_strides = (y.strides[0],)*2
+            stripes = np.lib.stride_tricks.as_strided(y, stripes_shape, stripes_strides)
+            yield from (stripes.argmax(0) == self.l).nonzero()[0] + self.i
+            self.i += count_consumed
+
+def run(ac, pd, y, sizes):
+    corr, energy, peaks = [], [], []
+    i = 0
+    for n in sizes:
+        for c, e in ac.process(y[i:i+n]):
+            corr.append(c)
+            energy.append(e)
+            peaks.extend(pd.process(c))
+        i += n
+    return np.concatenate(corr), np.concatenate(energy), np.array(peaks)
+
+def capture(n, nChannelsPerFrame):
+    # noise with bursts of a repeating 16-sample pattern
+    y = np.random.standard_normal((n, nChannelsPerFrame)) + 1j*np.random.standard_normal((n, nChannelsPerFrame))
+    for start in np.random.randint(0, n-160, n//2000):
+        y[start:start+160] += np.tile(3*np.random.standard_normal((16, nChannelsPerFrame)), (10, 1))
+    return y
+
+# However the input is chopped up, the streaming front end must produce the
+# same correlation, energy and peaks as the reference.
+np.random.seed(0)
+quantum, width, l = 16, 10, 9
+for trial in range(50):
+    nChannelsPerFrame = np.random.randint(1, 3)
+    y = capture(np.random.randint(1000, 20000), nChannelsPerFrame)
+    sizes = np.random.randint(1, np.random.choice([20, 300, 5000]), y.shape[0])
+    corr, energy, peaks = run(correlator.Autocorrelator(nChannelsPerFrame, quantum, width),
+                              correlator.PeakDetector(l, quantum), y, sizes)
+    ref_corr, ref_energy, _ = run(ReferenceAutocorrelator(nChannelsPerFrame, quantum, width),
+                                  ReferencePeakDetector(l, quantum), y, [y.shape[0]])
+    ref_peaks = list(ReferencePeakDetector(l, quantum).process(corr))
+    assert corr.size == ref_corr.size, trial
+    assert np.allclose(corr, ref_corr) and np.allclose(energy, ref_energy), trial
+    assert (peaks[:,0] == np.array(ref_peaks) * quantum).all(), trial
+print('streaming front end matches reference')
+
+for trial in range(200):
+    x = np.random.randint(0, 5, np.random.randint(0, 100)).astype(float)
+    w = np.random.randint(1, 12)
+    ref = np.array([x[j:j+w].max() for j in range(x.size-w+1)])
+    assert (correlator.sliding_max(x, w) == ref).all(), trial
+print('sliding_max matches reference')
+
+# On values from a steady distribution, the noise floor's threshold settles
+# where the false alarm target says, and lets every value through until it
+# has seen warmup of them.
+for false_alarm_rate in (1e-2, 1e-3):
+    floor = correlator.NoiseFloor(false_alarm_rate, 4096, 256, .75)
+    floor.update(np.random.normal(.2, .05, 255))
+    assert floor.threshold == 0
+    x = np.random.normal(.2, .05, 400000)
+    for i in range(0, x.size, 37):
+        floor.update(x[i:i+37])
+    rate = (np.random.normal(.2, .05, 1000000) > floor.threshold).mean()
+    assert false_alarm_rate / 2 < rate < false_alarm_rate * 2, (false_alarm_rate, rate)
+print('NoiseFloor threshold converges on the false alarm rate')
+
+def frame(nsyms=20):
+    # baseband preamble, a BPSK SIGNAL symbol and nsyms QPSK data symbols
+    parts = [rates.QAM(Nbpsc).symbols[np.random.randint(0, 2**Nbpsc, (n, ofdm.L.Nsc))]
+             for Nbpsc, n in ((1, 1), (2, nsyms))]
+    return ofdm.L.encode(parts, 1, 1)[:,0]
+
+power = (abs(frame())**2).mean()
+
+def noise(n, snr_db):
+    # complex noise snr_db below a frame
+    return (np.random.standard_normal(n) + 1j*np.random.standard_normal(n)) * (power/2)**.5 * 10**(-snr_db/20)
+
+def detect(d, y):
+    return np.array([peak for i in range(0, y.size, 512) for peak in d.process(y[i:i+512,None].astype(np.complex64))])
+
+def found(peaks, starts):
+    return [abs(peaks - start).min() <= quantum for start in starts]
+
+# On pure noise, once the floor has warmed up, about false_alarm_rate of the
+# metric values are taken for frames.
+for false_alarm_rate in (1e-2, 1e-3):
+    d = correlator.Clause18Detector(1, 1, false_alarm_rate)
+    detect(d, noise(20000, 0))
+    detections = d.detections
+    n = 1 << 20
+    detect(d, noise(n, 0))
+    rate = (d.detections - detections) / (n / quantum)
+    assert false_alarm_rate / 3 < rate < false_alarm_rate * 3, (false_alarm_rate, rate)
+print('Clause18Detector false alarms on noise match false_alarm_rate')
+
+# A frame 3 dB above the noise is found, whether it comes before the floor
+# has warmed up or long after.
+y = noise(400000, 3)
+starts = [100] + list(range(50000, 400000, 50000))
+for start in starts:
+    x = frame()
+    y[start:start+x.size] += x
+assert all(found(detect(correlator.Clause18Detector(1, 1), y), starts))
+print('Clause18Detector finds frames just above the noise')
+
+# Back-to-back frames with no noise between them hold the floor up, which
+# only the ceiling keeps from shutting out the frames themselves.
+for ceiling in (.75, 1.):
+    frames = [frame(1) for i in range(100)]
+    starts = np.cumsum([0] + [x.size for x in frames[:-1]])
+    y = np.concatenate(frames)
+    d = correlator.Clause18Detector(1, 1, ceiling=ceiling)
+    hits = sum(found(detect(d, y + noise(y.size, 30)), starts))
+    if ceiling < 1:
+        assert hits == len(frames) and d.floor.threshold == ceiling, hits
+    else:
+        assert hits < len(frames) // 4, hits
+print('the ceiling lets back-to-back frames through')
+
+# A bare short training sequence or a burst of noise repeating every quantum
+# clears the noise floor as a frame does, but only a frame has a long
+# training sequence to confirm it.  The floor passes the same peaks either
+# way, and every count stays consistent with what was handed on.
+y = noise(120000, 3)
+starts = {'frame': [], 'sts': [], 'burst': []}
+for j, start in enumerate(range(20000, 110000, 6000)):
+    kind = ('frame', 'sts', 'burst')[j % 3]
+    x = frame()
+    if kind == 'sts':
+        x = x[:ofdm.L.N_sts_samples]
+    elif kind == 'burst':
+        x = np.tile(noise(quantum, 0), 10)
+    y[start:start+x.size] += x
+    starts[kind].append(start)
+plain = correlator.Clause18Detector(1, 1)
+confirmed = correlator.Clause18Detector(1, 1, confirm_lts=True)
+plain_peaks, confirmed_peaks = detect(plain, y), detect(confirmed, y)
+for kind, where in starts.items():
+    assert all(found(plain_peaks, where)), kind
+    hits = found(confirmed_peaks, where)
+    assert all(hits) if kind == 'frame' else not any(hits), kind
+assert plain.peaks == confirmed.peaks and plain.detections == confirmed.detections
+assert plain.confirmed == plain.detections == plain_peaks.size
+assert confirmed.confirmed == confirmed_peaks.size and not confirmed.pending
+assert confirmed.detections - confirmed.confirmed >= len(starts['sts']) + len(starts['burst'])
+assert confirmed.peaks > confirmed.detections
+print('confirm_lts passes frames and rejects bare STSs and noise bursts')
+
+# Microbenchmark: a long capture at the 12 kHz baseband rate of the audio
+# channel, fed in buffers of the size the decoder block sees and larger.
+fs, seconds = 12e3, 300
+for nChannelsPerFrame in (1, 2):
+    y = capture(int(fs*seconds), nChannelsPerFrame)
+    for buffer_size in (512, 8192):
+        sizes = [buffer_size] * (y.shape[0] // buffer_size)
+        for name, ac, pd in (
+            ('reference', ReferenceAutocorrelator(nChannelsPerFrame, quantum, width), ReferencePeakDetector(l, quantum)),
+            ('streaming', correlator.Autocorrelator(nChannelsPerFrame, quantum, width), correlator.PeakDetector(l, quantum)),
+        ):
+            t0 = time.time()
+            run(ac, pd, y, sizes)
+            dt = time.time() - t0
+            print('%s, %d channel(s), %d-sample buffers: %.0fx real time' % (name, nChannelsPerFrame, buffer_size, seconds/dt))
+        d = correlator.Clause18Detector(nChannelsPerFrame, 1)
+        t0 = time.time()
+        for i in range(0, y.shape[0], buffer_size):
+            for peak in d.process(y[i:i+buffer_size]):
+                pass
+        dt = time.time() - t0
+        print('Clause18Detector, %d channel(s), %d-sample buffers: %.0fx real time' % (nChannelsPerFrame, buffer_size, seconds/dt))
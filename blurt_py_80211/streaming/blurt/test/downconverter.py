@@ -0,0 +1,50 @@
+import time
+import numpy as np
+import scipy.signal
+import blurt
+from blurt.phy import iir
+from blurt.phy.downconverter import Downconverter
+
+def run(d, x, sizes):
+    output, i = [], 0
+    for n in sizes:
+        output.append(d(x[i:i+n]))
+        i += n
+    return np.concatenate(output)
+
+# Streaming in pieces of any size must match mixing at the full rate,
+# filtering with the same taps and then decimating.
+np.random.seed(0)
+for trial, (Fs, Fc, factor) in enumerate([(96e3, 17e3, 8), (48e3, 12e3, 32), (44.1e3, 10e3, 16)] * 5):
+    nChannelsPerFrame = np.random.randint(1, 3)
+    x = np.random.standard_normal((np.random.randint(1000, 50000), nChannelsPerFrame)).astype(np.float32)
+    d = Downconverter(Fs, Fc, factor, nChannelsPerFrame)
+    y = run(d, x, np.random.randint(1, np.random.choice([10, 1000, 20000]), x.shape[0]))
+    g = (d.taps[:,0] + 1j*d.taps[:,1]).ravel()[::-1]
+    mixed = x * np.exp(-1j*2*np.pi*Fc/Fs*np.arange(x.shape[0]))[:,None]
+    h = g * np.exp(-1j*2*np.pi*Fc/Fs*np.arange(g.size))
+    ref = scipy.signal.lfilter(h, 1, mixed, axis=0)[::factor]
+    assert y.shape == ref.shape, trial
+    assert abs(y - ref).max() < 1e-4 * abs(ref).max(), trial
+print('Downconverter matches mixing, filtering and decimating')
+
+# Microbenchmark against mixing at the full rate and running the IIR lowpass
+# on every sample, as the decoder block used to.
+Fs, Fc, factor, buffer_size, seconds = 96e3, 17e3, 8, 4096, 60
+for nChannelsPerFrame in (1, 2):
+    x = np.random.standard_normal((int(Fs*seconds), nChannelsPerFrame)).astype(np.float32)
+    lp = iir.IIRFilter.lowpass(.45/factor, shape=(None, nChannelsPerFrame), axis=0)
+    Omega = 2*np.pi*Fc/Fs
+    t0 = time.time()
+    for i in range(0, x.shape[0], buffer_size):
+        y = x[i:i+buffer_size]
+        y = lp(y * np.exp(-1j*Omega * np.r_[i:i+y.shape[0]])[:,None])
+        y = y[-i%factor::factor]
+    dt = time.time() - t0
+    print('IIR, %d channel(s): %.0fx real time' % (nChannelsPerFrame, seconds/dt))
+    d = Downconverter(Fs, Fc, factor, nChannelsPerFrame)
+    t0 = time.time()
+    for i in range(0, x.shape[0], buffer_size):
+        d(x[i:i+buffer_size])
+    dt = time.time() - t0
+    print('polyphase, %d channel(s): %.0fx real time' % (nChannelsPerFrame, seconds/dt))
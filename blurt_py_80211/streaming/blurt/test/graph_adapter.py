@@ -0,0 +1,116 @@
+import io
+import time
+import queue
+import types
+import contextlib
+import numpy as np
+import blurt
+from blurt.phy.ieee80211a import Channel, IEEE80211aEncoderBlock, IEEE80211aDecoderBlock, Clause18Decoder
+
+channel = Channel(96e3, 17e3, 8)
+
+def capture(datagrams, snr_db):
+    # the frames one after another with silence between them, then noise
+    # throughout
+    waveforms = IEEE80211aEncoderBlock(channel, 1).encode_batch(datagrams, 6)
+    gap = np.zeros((np.random.randint(2000, 20000), 1), np.float32)
+    y = np.concatenate([gap] + [x for waveform in waveforms for x in (waveform, gap)] + [np.zeros((48000, 1))])
+    rms = np.concatenate(waveforms).std()
+    return (y + np.random.standard_normal(y.shape) * rms * 10**(-snr_db/20)).astype(np.float32)
+
+def decoder_block(workers, decoder_class=Clause18Decoder):
+    d = IEEE80211aDecoderBlock(channel)
+    d.decoder_class = decoder_class
+    d.workers = workers
+    d.nChannelsPerFrame = 1
+    d.input_queues = (queue.Queue(),)
+    d.output_queues = (queue.Queue(),)
+    d.nextOutputTag = lambda: None
+    d.graph = types.SimpleNamespace(notify=lambda: None, runloop=None)
+    d.start()
+    return d
+
+def decode(d, y, chunk=4096):
+    # feed y through d a chunk at a time, then wait for its decoders to
+    # finish; returns what it output
+    with contextlib.redirect_stderr(io.StringIO()):
+        for k in range(0, y.shape[0], chunk):
+            d.input_queues[0].put(((y[k:k+chunk], 0, 0), None))
+            d.process()
+        while d.busy or not d.completed.empty():
+            time.sleep(.01)
+            d.process()
+    d.stopped()
+    output = []
+    while not d.output_queues[0].empty():
+        output.append(d.output_queues[0].get_nowait()[0])
+    return output
+
+# Decoding on the runloop and on a thread pool must give the same results,
+# in the order the frames were sent.
+np.random.seed(0)
+datagrams = [bytes(np.random.randint(0, 256, np.random.randint(1, 400), dtype=np.uint8)) for i in range(12)]
+y = capture(datagrams, 25)
+inline = decode(decoder_block(0), y)
+pooled = decode(decoder_block(4), y)
+assert [datagram for datagram, snr in inline] == datagrams
+assert pooled == inline
+print('workers=0 and workers=4 output the same datagrams, in order')
+
+# A decoder that raises loses only its own frame.
+class Faulty(Clause18Decoder):
+    def process(self, y):
+        result = super().process(y)
+        if result and result[0] == datagrams[5]:
+            raise RuntimeError('faulty decoder')
+        return result
+for workers in (0, 4):
+    d = decoder_block(workers, Faulty)
+    output = decode(d, y)
+    assert [datagram for datagram, snr in output] == datagrams[:5] + datagrams[6:], workers
+    assert d.outcomes['error'] == 1 and d.outcomes['ok'] == len(datagrams) - 1, workers
+print('an exception in a decoder fails its frame and decoding goes on')
+
+# With more detections than max_decoders, the idle decoder with the lowest
+# score makes way, the oldest of those tied; detections past max_decoders
+# waiting in one buffer are dropped.
+class Scripted:
+    # detections at the baseband sample indices listed for each buffer
+    peaks = {}
+    def __init__(self, nChannelsPerFrame, oversample):
+        self.buffers = 0
+    def process(self, y):
+        self.buffers += 1
+        yield from self.peaks.get(self.buffers - 1, ())
+
+class Idle:
+    # never finishes; its score is fixed by where it starts
+    scores = {}
+    def __init__(self, i, nChannelsPerFrame, oversample):
+        self.reset(i)
+    def reset(self, i):
+        self.start = i
+        self.score = self.scores[i]
+    def process(self, y):
+        return None
+
+d = decoder_block(0, Idle)
+d.max_decoders = 3
+d.detector = Scripted(1, 1)
+buffer = 4096 // channel.upsample_factor
+Scripted.peaks = {0: [100, 200, 300], 1: [buffer+100], 2: [2*buffer+100], 3: [3*buffer+100],
+                  4: [4*buffer + 100*i for i in range(5)]}
+Idle.scores = {100: -1, 200: -3, 300: -3, buffer+100: -2, 2*buffer+100: 0, 3*buffer+100: 0}
+Idle.scores.update({4*buffer + 100*i: i for i in range(5)})
+running = []
+for k in range(5):
+    d.input_queues[0].put(((np.zeros((4096, 1), np.float32), 0, 0), None))
+    d.process()
+    running.append(sorted(d.decoders.values()))
+assert running[:4] == [[100, 200, 300], [100, 300, buffer+100], [100, buffer+100, 2*buffer+100],
+                       [100, 2*buffer+100, 3*buffer+100]], running
+assert running[4] == [4*buffer, 4*buffer+100, 4*buffer+200], running
+assert d.outcomes == {'evicted': 6, 'dropped': 2}, d.outcomes
+assert len(d.pool) + len(d.decoders) == 3
+d.stopped()
+print('admit evicts the lowest score, oldest first, and drops what cannot wait')
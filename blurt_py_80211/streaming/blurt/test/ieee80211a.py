@@ -0,0 +1,95 @@
+import numpy as np
+import blurt
+from blurt.phy import ofdm, rates, ieee80211a
+from blurt.phy.crc import CRC32_802_11_FCS as FCS
+
+def frame(octets, rate=6, SIGNAL=None):
+    # baseband frame carrying octets, under the SIGNAL field given, if any
+    rateEncoding = ieee80211a.rateEncodings[rate]
+    psdu = np.r_[np.zeros(2, np.uint8), octets, FCS.compute_octets(octets)]
+    if SIGNAL is None:
+        SIGNAL = rateEncoding | ((octets.size+4) << 5)
+        SIGNAL |= (bin(SIGNAL).count('1') & 1) << 17
+    signal, = ofdm.L.subcarriersFromOctetsBatch([np.frombuffer(SIGNAL.to_bytes(3, 'little'), np.uint8)],
+                                                rates.L_rate(0xb), [0], [18])
+    payload, = ofdm.L.subcarriersFromOctetsBatch([psdu], rates.L_rate(rateEncoding), [np.random.randint(1, 128)])
+    return ofdm.L.encode([signal, payload], 1, 1)[:,0]
+
+def received(x, snr_db, lead):
+    # through a flat channel with a carrier offset, after lead samples of
+    # noise
+    y = np.zeros((lead + x.size + 100, 1), complex)
+    y[lead:lead+x.size,0] = x * np.exp(1j*np.random.uniform(-.01, .01)*np.arange(x.size)) * \
+        np.exp(2j*np.pi*np.random.uniform())
+    noise = np.random.standard_normal(y.shape) + 1j*np.random.standard_normal(y.shape)
+    return (y + noise * (abs(x)**2).mean()**.5 * 10**(-snr_db/20) / 2**.5).astype(np.complex64)
+
+def decode(y, peek=True):
+    d = ieee80211a.Clause18Decoder(0, 1, 1)
+    d.peeked = not peek
+    return d.process(y), d.outcome
+
+def header(rateEncoding, length):
+    SIGNAL = rateEncoding | (length << 5)
+    return SIGNAL | (bin(SIGNAL).count('1') & 1) << 17
+
+# The detector places frames only to within a quantum, so the peek must
+# find a valid header anywhere up to a quantum either side of the nominal
+# start.
+np.random.seed(0)
+d = ieee80211a.Clause18Decoder(0, 1, 1)
+quantum = ofdm.L.nfft // 4
+for shift in range(-quantum, quantum+1):
+    octets = np.random.randint(0, 256, 100).astype(np.uint8)
+    y = received(frame(octets, 24), 20, 2*quantum)[2*quantum+shift:]
+    SIGNAL_bits = [d.decodeSignal(lsig) for lsig in ofdm.L.peekSignal(y, d.precision)]
+    assert header(0x9, 104) in SIGNAL_bits, shift
+    result, outcome = decode(y)
+    assert outcome == 'ok' and result[0] == octets.tobytes(), shift
+print('peekSignal finds the header up to a quantum off')
+
+# Each way a header can be invalid ends the frame at the peek, and is
+# recorded as such.
+octets = np.random.randint(0, 256, 100).astype(np.uint8)
+for SIGNAL, outcome in ((header(0x9, 104) ^ 1 << 17, 'early parity'),
+                        (header(0x1, 104), 'early rate'),
+                        (header(0x9, 2000), 'early length')):
+    y = received(frame(octets, 24, SIGNAL), 30, 0)
+    d = ieee80211a.Clause18Decoder(0, 1, 1)
+    assert d.process(y[:ofdm.L.N_training_samples-1]) is None
+    assert d.process(y[:ofdm.L.N_training_samples]) == () and d.outcome == outcome, outcome
+    assert not d.trained
+print('invalid headers are rejected at the peek')
+
+# Near the noise floor, where headers are decoded only some of the time,
+# the peek must not drop any frame that decoding without it recovers.
+recovered = peeked = 0
+for trial in range(400):
+    octets = np.random.randint(0, 256, 40).astype(np.uint8)
+    y = received(frame(octets), np.random.uniform(0, 3), quantum)[np.random.randint(0, 2*quantum+1):]
+    result, outcome = decode(y, False)
+    if outcome == 'ok':
+        recovered += 1
+        assert decode(y) == (result, 'ok'), trial
+    peeked += decode(y)[1] == 'ok'
+print('the peek loses no frames: %d/400 with it, %d/400 without' % (peeked, recovered))
+
+# A pooled decoder starting on a new frame must decode it exactly as a
+# fresh one does, whether the last frame it had was finished, abandoned
+# partway through its data, or dropped at the header.
+def fresh(y):
+    d = ieee80211a.Clause18Decoder(0, 1, 1)
+    return d.process(y), d.outcome
+frames = [received(frame(np.random.randint(0, 256, n).astype(np.uint8), rate), 25, 0)
+          for n, rate in ((1500, 54), (300, 6), (40, 24), (800, 12))]
+frames.append(received(frame(octets, 24, header(0x1, 104)), 30, 0))
+d = ieee80211a.Clause18Decoder(0, 1, 1)
+for before in frames:
+    for after in frames:
+        for cut in (before.shape[0], before.shape[0] // 2):
+            d.reset(0)
+            d.process(before[:ofdm.L.N_training_samples])
+            d.process(before[:cut])
+            d.reset(0)
+            assert (d.process(after), d.outcome) == fresh(after)
+print('reset leaves nothing of the last frame behind')
@@ -0,0 +1,62 @@
+import numpy as np
+import blurt
+from blurt.phy import ofdm, rates
+
+def frame(nsyms):
+    # preamble, a BPSK SIGNAL symbol and nsyms QPSK data symbols
+    parts = [rates.QAM(Nbpsc).symbols[np.random.randint(0, 2**Nbpsc, (n, ofdm.L.Nsc))]
+             for Nbpsc, n in ((1, 1), (2, nsyms))]
+    return ofdm.L.encode(parts, 1, 1)[:,0]
+
+def received(x, M, snr_db, lead=0):
+    # through a flat channel to each of M microphones, with a carrier offset,
+    # after lead samples of noise
+    gains = np.random.standard_normal(M) + 1j*np.random.standard_normal(M)
+    y = np.zeros((lead + x.size + 100, M), complex)
+    y[lead:lead+x.size] = (x * np.exp(1j*np.random.uniform(-.01, .01)*np.arange(x.size)))[:,None] * gains
+    noise = np.random.standard_normal(y.shape) + 1j*np.random.standard_normal(y.shape)
+    return y + noise * (abs(x)**2).mean()**.5 * 10**(-snr_db/20) / 2**.5
+
+def relative(a, b):
+    return abs(a - b).max() / abs(b).max()
+
+# The batched EKF must track the pilots as the per-symbol matrix EKF does,
+# whether the symbols arrive all at once or in pieces.
+np.random.seed(0)
+for trial in range(20):
+    M = np.random.randint(1, 4)
+    nsyms = np.random.randint(1, 200)
+    y = received(frame(nsyms), M, np.random.uniform(5, 30))
+    training_data, i = ofdm.L.train(y)
+    i += ofdm.L.nsym
+    syms = y[i:i+nsyms*ofdm.L.nsym].reshape(nsyms, ofdm.L.nsym, M)
+    reference = np.array(list(ofdm.L.ekfDecoder_reference(syms, i, training_data)))
+    d = ofdm.EKFDecoder(ofdm.L, i, training_data)
+    pieces = np.split(syms, np.sort(np.random.randint(0, nsyms, 3)))
+    output = np.concatenate([d.process(piece) for piece in pieces])
+    assert relative(output, reference) < 1e-9, trial
+print('EKFDecoder matches ekfDecoder_reference')
+
+# The batched training search must settle on the same LTS offset and
+# equalizer as searching one candidate offset at a time.
+for trial in range(20):
+    M = np.random.randint(1, 4)
+    y = received(frame(1), M, np.random.uniform(5, 30), np.random.randint(0, 8))
+    (G, uncertainty, var_ni, Omega), i = ofdm.L.train(y)
+    (G_ref, uncertainty_ref, var_ni_ref, Omega_ref), i_ref = ofdm.L.train_reference(y)
+    assert i == i_ref, trial
+    assert relative(G, G_ref) < 1e-9, trial
+    assert np.isclose(uncertainty, uncertainty_ref) and np.isclose(var_ni, var_ni_ref), trial
+print('train matches train_reference')
+
+# A coarse search refined around its best candidate should land on the
+# offset of the exhaustive search, or next to it.
+L = type(ofdm.L)()
+L.trainingSearchStride = 4
+for trial in range(50):
+    M = np.random.randint(1, 4)
+    y = received(frame(1), M, np.random.uniform(5, 30), np.random.randint(0, 8))
+    training_data, i = L.train(y)
+    training_data, i_ref = L.train_reference(y)
+    assert abs(i - i_ref) <= 1, (trial, i, i_ref)
+print('train with stride 4 matches train_reference')
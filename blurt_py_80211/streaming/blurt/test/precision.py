@@ -0,0 +1,64 @@
+import time
+import numpy as np
+import blurt
+from blurt.phy import ofdm, rates
+from blurt.phy.crc import CRC32_802_11_FCS as FCS
+from blurt.phy.precision import single, double
+from blurt.phy.ieee80211a import Clause18Decoder, rateEncodings
+
+def baseband(octets, rate):
+    # a frame as the encoder block builds it, before upconversion
+    rateEncoding = rateEncodings[rate]
+    SIGNAL = rateEncoding | ((octets.size+4) << 5)
+    SIGNAL |= (bin(SIGNAL).count('1') & 1) << 17
+    parts = (ofdm.L.subcarriersFromOctets(np.frombuffer(SIGNAL.to_bytes(3, 'little'), np.uint8), rates.L_rate(0xb), 0, 18),
+             ofdm.L.subcarriersFromOctets(np.r_[np.zeros(2, np.uint8), octets, FCS.compute_octets(octets)],
+                                          rates.L_rate(rateEncoding), np.random.randint(1, 127)))
+    return ofdm.L.encode(parts, 1, 1)
+
+def received(x, snr_db, lead=100):
+    # through a flat channel with a carrier offset, after lead samples of noise
+    gain = np.exp(2j*np.pi*np.random.random_sample()) * 10**(np.random.uniform(-1, 1))
+    y = np.zeros((lead + x.shape[0] + 100, 1), complex)
+    y[lead:lead+x.shape[0]] = x * gain * np.exp(1j*np.random.uniform(-.01, .01)*np.arange(x.shape[0]))[:,None]
+    noise = np.random.standard_normal(y.shape) + 1j*np.random.standard_normal(y.shape)
+    return y + noise * abs(gain) * (abs(x)**2).mean()**.5 * 10**(-snr_db/20) / 2**.5
+
+def decode(y, precision, start=100):
+    d = Clause18Decoder(start, 1, 1)
+    d.precision = precision
+    return d.process(y[start:].astype(precision.complex))
+
+# Single precision costs no more than a few frames per hundred against double
+# on the same received samples, at every SNR and rate.
+np.random.seed(0)
+nframes = 100
+for rate, snrs in ((6, (2, 4, 8)), (24, (10, 12, 16)), (36, (14, 16, 20)), (48, (18, 20, 24)), (54, (20, 22, 26))):
+    for snr_db in snrs:
+        errors = {single: 0, double: 0}
+        differ = 0
+        for trial in range(nframes):
+            octets = np.random.randint(0, 256, 100).astype(np.uint8)
+            y = received(baseband(octets, rate), snr_db)
+            ok = {}
+            for precision in (single, double):
+                result = decode(y, precision)
+                ok[precision] = bool(result) and result[0] == octets.tobytes()
+                errors[precision] += not ok[precision]
+            differ += ok[single] != ok[double]
+        print('%2d Mbps at %2d dB: PER %.2f in single precision, %.2f in double' %
+              (rate, snr_db, errors[single] / nframes, errors[double] / nframes))
+        assert errors[single] <= errors[double] + .03 * nframes, (rate, snr_db)
+        assert differ <= .05 * nframes, (rate, snr_db)
+
+# Microbenchmark: decoding a long frame in each precision, keeping the
+# fastest of several runs.
+octets = np.random.randint(0, 256, 1000).astype(np.uint8)
+y = received(baseband(octets, 24), 30)
+for precision in (double, single):
+    dt = np.inf
+    for i in range(20):
+        t0 = time.time()
+        assert decode(y, precision)[0] == octets.tobytes()
+        dt = min(dt, time.time() - t0)
+    print('1000-octet frame at 24 Mbps: %.2f ms to decode in %s' % (dt * 1e3, np.dtype(precision.complex).name))
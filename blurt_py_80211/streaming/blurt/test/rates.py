@@ -0,0 +1,31 @@
+import numpy as np
+import blurt
+from blurt.phy import rates, ofdm
+from blurt.phy.interleaver import interleave
+
+# The separable demapper must agree with the full-constellation reference,
+# up to rounding, and the approximations must make the same hard decisions.
+np.random.seed(0)
+for Nbpsc in (1, 2, 4, 6, 8):
+    q = rates.QAM(Nbpsc)
+    y = q.symbols[np.random.randint(0, q.symbols.size, 2000)]
+    y = y + .1 * (np.random.standard_normal(y.size) + 1j*np.random.standard_normal(y.size))
+    reference = q.demap_reference(y, .02)
+    assert abs(q.demap(y, .02) - reference).max() <= 1, Nbpsc
+    confident = abs(reference) > 5
+    for method in ('exact', 'maxlog', 'linear'):
+        out = np.empty((y.size, Nbpsc), np.int8)
+        assert q.demap(y, .02, out, method) is out
+        assert (np.sign(out) == np.sign(reference))[confident].all(), (Nbpsc, method)
+print('demap matches demap_reference')
+
+# One gather through the decoder map equals deinterleaving then depuncturing.
+for encoding in (0xb, 0xf, 0xa, 0xe, 0x9, 0xd, 0x8, 0xc):
+    rate = rates.L_rate(encoding)
+    assert rate is rates.L_rate(encoding)
+    Ncbps = ofdm.L.Nsc * rate.Nbpsc
+    y = np.random.randint(-127, 128, 3*Ncbps)
+    expected = np.concatenate([rate.depuncture(interleave(y[i:i+Ncbps], Ncbps, rate.Nbpsc, reverse=True))
+                               for i in range(0, y.size, Ncbps)])
+    assert (rate.deinterleave_depuncture(y, ofdm.L.Nsc) == expected).all(), encoding
+print('deinterleave_depuncture matches interleave and depuncture')
@@ -0,0 +1,38 @@
+import numpy as np
+import blurt
+from blurt.phy.ring import SampleRing, History
+
+# Views of a SampleRing must read back what was written at those absolute
+# indices, across wraparound and growth, and stay valid until released.
+np.random.seed(0)
+for trial in range(50):
+    nChannelsPerFrame = np.random.randint(1, 3)
+    stream = np.random.standard_normal((100000, nChannelsPerFrame)) + 0j
+    ring = SampleRing((nChannelsPerFrame,), complex, capacity=np.random.choice([16, 256, 4096]))
+    held = []
+    i = 0
+    while i < stream.shape[0]:
+        n = np.random.randint(1, 2000)
+        ring.write(stream[i:i+n])
+        i = ring.end
+        for start, view in held:
+            assert (view == stream[start:start+view.shape[0]]).all(), trial
+        start = np.random.randint(ring.start, ring.end)
+        held.append((start, ring[start:ring.end]))
+        held = [h for h in held if np.random.random_sample() < .9]
+        ring.release(min([start for start, view in held] + [ring.end - np.random.randint(0, 3000)]))
+    assert ring.capacity >= len(ring), trial
+print('SampleRing views match the stream')
+
+# History keeps the newest entries contiguous however they are appended.
+for trial in range(50):
+    stream = np.random.standard_normal((20000, 2))
+    history = History((2,), capacity=np.random.choice([1, 64, 4096]))
+    i = 0
+    while i < stream.shape[0]:
+        n = np.random.randint(1, 500)
+        data = history.extend(stream[i:i+n])
+        i += n
+        assert (data == stream[history.k:i]).all(), trial
+        history.keep(np.random.randint(0, 1000))
+print('History matches the stream')
@@ -0,0 +1,91 @@
+import time
+import types
+import warnings
+import numpy as np
+import blurt
+from blurt.audio.graph_adapter import ScheduledOutStream_SinkBlock
+from blurt.phy.ieee80211a import Channel, IEEE80211aEncoderBlock
+
+Fs = 48000
+nFrames = 256
+
+def sink(render, lead=.1, capacity=1<<18):
+    s = ScheduledOutStream_SinkBlock(render, Fs, 2, lead, capacity)
+    s.graph = types.SimpleNamespace(notify=None, runloop=None)
+    s.warnOnMiss = False
+    s.start()
+    return s
+
+def play(s, seconds, submit={}):
+    # call read() the way the IO proc does, in real time, enqueueing
+    # submit[i] just before the ith call as if it arrived at that call's
+    # output time; returns the output and the output time of each sample
+    t0 = time.monotonic()
+    out, times = [], []
+    for i in range(int(seconds * Fs / nFrames)):
+        outputTime = t0 + i * nFrames / Fs
+        if i in submit:
+            s.enqueue(submit[i], outputTime)
+        time.sleep(max(outputTime - time.monotonic(), 0))
+        out.append(s.read(nFrames, outputTime, time.monotonic()))
+        times.append(outputTime + np.arange(nFrames) / Fs)
+    return np.concatenate(out), np.concatenate(times)
+
+def constant(items):
+    return [np.full((length, 2), value, np.float32) for value, length in items]
+
+# Isolated frames come out whole, in order, lead seconds' worth of samples
+# after they were queued, and none miss; long frames stream through a small
+# ring.
+s = sink(constant, capacity=1<<14)
+submit = {20: [(1, 3000)], 60: [(2, 40000), (3, 500)], 300: [(4, 100)]}
+y, t = play(s, 2, submit)
+s.stopped()
+for value, length in (v for items in submit.values() for v in items):
+    where = (y[:,0] == value).nonzero()[0]
+    assert where.size == length and where[-1] - where[0] == length - 1, value
+assert (y[:,0] == 2).nonzero()[0][-1] + 1 == (y[:,0] == 3).nonzero()[0][0]
+for i, items in submit.items():
+    assert (y[:,0] == items[0][0]).nonzero()[0][0] == i*nFrames + round(s.lead*Fs), i
+assert s.frames == 4 and s.misses == 0
+print('frames play whole, in order and lead seconds after they were queued')
+
+# A frame that takes longer than the lead to render misses its deadline,
+# but still plays.
+def slow(items):
+    time.sleep(.15)
+    return constant(items)
+s = sink(slow)
+y, t = play(s, 1, {10: [(5, 1000)]})
+s.stopped()
+assert (y[:,0] == 5).sum() == 1000
+assert s.misses == 1 and s.latencies[0] > s.lead
+print('late frames are counted as misses')
+
+# A render that fails loses its batch, and later frames still play.
+def flaky(items):
+    if items[0][0] == 6:
+        raise RuntimeError('render failed')
+    return constant(items)
+s = sink(flaky)
+y, t = play(s, 1, {10: [(6, 1000)], 20: [(7, 1000)]})
+s.stopped()
+assert not (y[:,0] == 6).any() and (y[:,0] == 7).sum() == 1000
+assert s.dropped == 1 and s.frames == 1
+print('failed renders are dropped')
+
+# A burst of encoded frames plays back to back, so it takes the airtime it
+# needs and no more.
+channel = Channel(Fs, 17e3, 8)
+e = IEEE80211aEncoderBlock(channel, 2)
+render = lambda datagrams: e.encode_batch(datagrams, 6)
+airtime = sum(w.shape[0] for w in render([np.random.bytes(76)] * 8)) / Fs
+# a generous lead keeps a loaded machine from missing the first deadline
+s = sink(render, lead=1)
+y, t = play(s, airtime + 1.5, {10: [np.random.bytes(76)] * 8})
+s.stopped()
+active = abs(y).max(1).nonzero()[0]
+assert s.frames == 8 and s.misses == 0
+assert (active[-1] - active[0]) / Fs < airtime
+print('a burst of %d frames took %.2f s of airtime, render latency %.1f ms median, %.1f ms max' %
+      (s.frames, airtime, np.median(s.latencies) * 1e3, max(s.latencies) * 1e3))
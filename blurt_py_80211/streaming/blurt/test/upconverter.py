@@ -0,0 +1,96 @@
+import time
+import types
+import numpy as np
+import scipy.signal
+import blurt
+from blurt.phy import iir, ofdm, rates
+from blurt.phy.upconverter import Upconverter
+from blurt.phy.ieee80211a import Channel, IEEE80211aEncoderBlock, preemphasis, rateEncodings
+
+# Each phase of the output must match stuffing zeros between the inputs,
+# filtering with the same taps and mixing at the full rate.
+np.random.seed(0)
+for trial, (Fs, Fc, factor) in enumerate([(96e3, 17e3, 2), (48e3, 12e3, 8), (44.1e3, 10e3/3, 4)] * 5):
+    nChannelsPerFrame = np.random.randint(1, 3)
+    x = np.random.standard_normal((np.random.randint(1, 5000), nChannelsPerFrame)) + \
+        1j*np.random.standard_normal((1, nChannelsPerFrame))
+    k = np.random.randint(0, 100000)
+    u = Upconverter(Fs, Fc, factor, nChannelsPerFrame)
+    y = u(x, k)
+    g = (u.taps[:u.blocks] - 1j*u.taps[u.blocks:])[::-1].ravel()
+    h = g * np.exp(-1j*u.Omega*np.arange(g.size))
+    stuffed = np.zeros(((x.shape[0] + u.blocks - 1) * factor, nChannelsPerFrame), complex)
+    stuffed[:x.shape[0]*factor:factor] = x
+    ref = (scipy.signal.lfilter(h, 1, stuffed, axis=0) * np.exp(1j*u.Omega*np.arange(k, k+stuffed.shape[0]))[:,None]).real
+    assert y.shape == ref.shape, trial
+    assert abs(y - ref).max() < 1e-4 * abs(ref).max(), trial
+print('Upconverter matches stuffing, filtering and mixing')
+
+# A cached preamble must match upconverting it afresh at whichever LO phase
+# it is reused.
+channel = Channel(96e3, 17e3, 8)
+e = IEEE80211aEncoderBlock(channel, 2)
+e.graph = types.SimpleNamespace(notify=None, runloop=None)
+e.start()
+x = ofdm.L.encodePreamble(e.oversample, 2, preemphasis)
+for trial in range(50):
+    k = np.random.randint(0, 1000000)
+    assert abs(e.preamble(k) - e.upconverter(x, k)).max() < 1e-5, trial
+assert len(e.preambles) <= e.upconverter.period
+print('cached preambles match upconverting afresh')
+
+# A batch must come out the same as encoding its frames one at a time.
+for trial in range(10):
+    datagrams = [np.random.bytes(np.random.randint(1, 300)) for i in range(np.random.randint(1, 10))]
+    rate = np.random.choice(list(rateEncodings))
+    k = e.k
+    np.random.seed(trial)
+    batch = e.encode_batch(datagrams, rate)
+    e.k = k
+    np.random.seed(trial)
+    for datagram, waveform in zip(datagrams, batch):
+        single, = e.encode_batch([datagram], rate)
+        assert single.shape == waveform.shape, trial
+        assert abs(single - waveform).max() < 1e-5, trial
+print('batches match single frames')
+
+# Microbenchmark against synthesizing the whole frame, upsampling by
+# repetition, running the IIR lowpass on every sample and mixing with a
+# fresh oscillator, as the encoder block used to.
+nframes = 50
+for length in (40, 1500):
+    subcarriers = (ofdm.L.subcarriersFromOctets(np.zeros(3, np.uint8), rates.L_rate(0xb), 0, 18),
+                   ofdm.L.subcarriersFromOctets(np.random.randint(0, 256, length+6).astype(np.uint8), rates.L_rate(0xb), 1))
+    factor = channel.upsample_factor // e.oversample
+    lp = iir.IIRFilter.lowpass(0.5*e.oversample/channel.upsample_factor, axis=0, shape=(None, 2))
+    Omega = 2*np.pi*channel.Fc/channel.Fs
+    t0 = time.time()
+    for k in range(nframes):
+        y = ofdm.L.encode(subcarriers, e.oversample, 2, preemphasis)
+        y = lp(np.repeat(y, factor, 0))
+        y = (y * np.exp(1j*Omega*np.r_[k*y.shape[0]:(k+1)*y.shape[0]])[:,None]).real
+    dt_iir = time.time() - t0
+    t0 = time.time()
+    for k in range(nframes):
+        y = ofdm.L.encodeData(subcarriers, e.oversample, 2, preemphasis)
+        e.preamble(k)
+        e.upconverter(y, k)
+    dt_polyphase = time.time() - t0
+    print('%d-octet frames: %.2f ms to synthesize and upconvert before, %.2f ms now' %
+          (length, dt_iir / nframes * 1e3, dt_polyphase / nframes * 1e3))
+
+# Microbenchmark: a burst of fragments, the way a fragmented datagram reaches
+# the encoder, one frame at a time against one batch.
+nbursts = 20
+burst = [np.random.bytes(100) for i in range(16)]
+t0 = time.time()
+for i in range(nbursts):
+    for datagram in burst:
+        e.encode_batch([datagram], 6)
+dt_single = time.time() - t0
+t0 = time.time()
+for i in range(nbursts):
+    e.encode_batch(burst, 6)
+dt_batch = time.time() - t0
+print('burst of %d 100-octet fragments: %.2f ms one at a time, %.2f ms as a batch' %
+      (len(burst), dt_single / nbursts * 1e3, dt_batch / nbursts * 1e3))
@@ -11,7 +11,7 @@ from .graph.tee import Tee, Arbiter
 from .graph.fileio import FileSink
 from .graph.selector import Selector
 from .audio import IOSession, MicrophoneAGCAdapter, CSMAOutStreamAdapter
-from .audio import InStream_SourceBlock, OutStream_SinkBlock, IOSession_Block
+from .audio import InStream_SourceBlock, OutStream_SinkBlock, ScheduledOutStream_SinkBlock, IOSession_Block
 from .audio import AudioHardware as AH
 from .net.graph_adapter import TunnelSink, TunnelSource
 from .mac.graph_adapter import PacketDispatchBlock, FragmentationBlock, ReassemblyBlock
@@ -27,6 +27,8 @@ vuThresh = 25
 recordToFile = False
 bypassAudio = False
 vuMeter = not bypassAudio
+prefetchTX = True # render frames on their own thread, txLead seconds ahead of output
+txLead = .1
 
 ############################ Audio ############################
 
@@ -53,7 +55,6 @@ class BlurtTransceiver:
                 self.agc = MicrophoneAGCAdapter()
                 self.csma = CSMAOutStreamAdapter(self.agc, vuThresh, self.outputChannels)
                 self.is_b = InStream_SourceBlock(self.ios)
-                self.os_b = OutStream_SinkBlock()
                 sources.append(self.is_b)
                 sources.append(self.ios_b)
             else:
@@ -67,10 +68,17 @@ class BlurtTransceiver:
             self.decoder_b = IEEE80211aDecoderBlock(rxchannel)
             self.encoder_b = IEEE80211aEncoderBlock(txchannel)
             self.encoder_b.preferredRate = 6
+            if not bypassAudio:
+                if prefetchTX:
+                    self.os_b = ScheduledOutStream_SinkBlock(
+                        lambda datagrams: self.encoder_b.encode_batch(datagrams, self.encoder_b.preferredRate),
+                        txchannel.Fs, self.encoder_b.nChannelsPerFrame, lead=txLead)
+                else:
+                    self.os_b = OutStream_SinkBlock()
             self.dispatch_b = PacketDispatchBlock()
             self.arbiter_b = Arbiter(len(tunnels))
             self.reassemblers = [ReassemblyBlock(utun.pdb) for utun in tunnels]
-            self.fragmenters = [FragmentationBlock(utun.pdb) for utun in tunnels]
+            self.fragmenters = [FragmentationBlock(utun.pdb, self.encoder_b.cache.hint) for utun in tunnels]
             self.tunnelSinks = [TunnelSink(utun) for utun in utun_by_ll_addr.values()]
             self.tunnelSources = [TunnelSource(utun, utun_other[utun].ll_addr) for utun in utun_by_ll_addr.values()]
             sources.extend(self.tunnelSources)
@@ -95,11 +103,15 @@ class BlurtTransceiver:
                     reassembly_b.connect(0, sink_b, 0)
             if 1:
                 # source_b -> fragmentation_b -> arbiter_b -> encoder_b -> os_b
+                # or, prefetching, arbiter_b -> os_b, which runs the encoder
                 for i, (source_b, fragmentation_b) in enumerate(zip(self.tunnelSources, self.fragmenters)):
                     source_b.connect(0, fragmentation_b, 0)
                     fragmentation_b.connect(0, self.arbiter_b, i)
-                self.arbiter_b.connect(0, self.encoder_b, 0)
-                self.encoder_b.connect(0, self.os_b, 0)
+                if prefetchTX and not bypassAudio:
+                    self.arbiter_b.connect(0, self.os_b, 0)
+                else:
+                    self.arbiter_b.connect(0, self.encoder_b, 0)
+                    self.encoder_b.connect(0, self.os_b, 0)
                 if not bypassAudio:
                     # os_b -> csma -> ios
                     self.csma.stream = self.os_b
@@ -1,13 +1,19 @@
 #define NPY_NO_DEPRECATED_API NPY_1_8_API_VERSION
 
+#include <cstdint>
+#include <cstring>
+#include <vector>
 #include "Python.h"
 #include "blitz/array.h"
 #include "numpy/arrayobject.h"
 
 template<class T> static const int numeric_type = 0;
 template<> int numeric_type<long> = NPY_LONG;
+template<> int numeric_type<npy_byte> = NPY_BYTE;
 template<> int numeric_type<npy_ubyte> = NPY_UBYTE;
+template<> int numeric_type<npy_short> = NPY_SHORT;
 template<> int numeric_type<npy_uint> = NPY_UINT;
+template<> int numeric_type<npy_uint64> = NPY_UINT64;
 template<> int numeric_type<double> = NPY_DOUBLE;
 
 template<class T, int N>
@@ -42,31 +48,13 @@ static blitz::Array<T,N> convert_to_blitz(PyArrayObject* arr_obj, const char* na
     return blitz::Array<T,N>((T*)PyArray_DATA(arr_obj), shape, strides, blitz::neverDeleteData);
 }
 
-static PyObject* crc(PyObject*self, PyObject* args)
-{
-    PyArrayObject *py_a = NULL, *py_lut = NULL;
-    if(!PyArg_ParseTuple(args,"O!O!:crc",&PyArray_Type,&py_a,&PyArray_Type,&py_lut))
-        return NULL;
-    try
-    {
-        auto a = convert_to_blitz<long,1>(py_a,"a");
-        auto lut = convert_to_blitz<npy_uint,1>(py_lut,"lut");
-        uint32_t r = 0, A=a.extent(blitz::firstDim);
-        for (uint32_t i=0; i<A; i++)
-            r = (r << 16) ^ a(i) ^ lut(r >> 16);
-        return PyLong_FromUnsignedLong(r);
-    }
-    catch(...)
-    {
-        return nullptr;
-    }
-}
-
-static PyObject* decode(PyObject*self, PyObject* args)
+// Scalar Viterbi decoder over all 128 shift register values, kept as the
+// reference implementation for decode().
+static PyObject* decode_reference(PyObject*self, PyObject* args)
 {
     PyArrayObject *py_x = NULL, *py_msg = NULL;
     long N;
-    if(!PyArg_ParseTuple(args,"lO!:decode",&N,&PyArray_Type,&py_x))
+    if(!PyArg_ParseTuple(args,"lO!:decode_reference",&N,&PyArray_Type,&py_x))
         return NULL;
     try
     {
@@ -74,6 +62,7 @@ static PyObject* decode(PyObject*self, PyObject* args)
         py_msg = (PyArrayObject *)PyArray_SimpleNew(1, (long[]){N}, NPY_UBYTE);
         auto msg = convert_to_blitz<npy_ubyte,1>(py_msg,"msg");
         const int M = 128;
+        Py_BEGIN_ALLOW_THREADS
         int64_t cost[M*2], scores[M] = {/* zero-initialized */};
         uint8_t bt[N][M];
         for (int k=0; k<N; k++)
@@ -98,6 +87,210 @@ static PyObject* decode(PyObject*self, PyObject* args)
             msg(k) = i >> 6;
             i = ((i<<1)&127) + j;
         }
+        Py_END_ALLOW_THREADS
+        return (PyObject *)py_msg;
+    }
+    catch(...)
+    {
+        Py_XDECREF(py_msg);
+        return nullptr;
+    }
+}
+
+// Vectorized Viterbi decoder for the K=7 code.
+//
+// Here state n holds the six most recent input bits with the newest in bit 0,
+// so the predecessors of states 2m and 2m+1 are m and m+32.  Each step
+// evaluates the 32 butterflies eight at a time in 128-bit GCC/Clang vectors,
+// which lower directly onto SSE2 or NEON; the butterfly inputs are the two
+// halves of the metric array and the outputs only need an interleave.  Soft
+// bits are int8, so a branch metric is at most 254 in magnitude and path
+// metrics spread by at most 24*254; int16 metrics are safe as long as they
+// are renormalized (by subtracting the metric of state 0) every few steps
+// and at the end of every call.
+// Ties go to the predecessor whose oldest bit is 0, exactly as in
+// decode_reference, so the two decoders agree bit for bit.  Decisions are
+// packed one bit per state, i.e. one uint64_t per trellis step, with state
+// 2m+b at bit m+32b.
+
+typedef int16_t v8s __attribute__((vector_size(16)));
+typedef int8_t v8c __attribute__((vector_size(8)));
+
+static const int acs_renorm_interval = 16;
+
+struct ACSTables
+{
+    v8s sign[2][2][2][4]; // [newest bit][oldest bit][output][m/8] -> +/-1
+
+    ACSTables(const blitz::Array<long,2> &output_map)
+    {
+        for (int b=0; b<2; b++)
+            for (int j=0; j<2; j++)
+                for (int o=0; o<2; o++)
+                    for (int m=0; m<32; m++)
+                    {
+                        // output_map is indexed by the shift register with the newest bit in bit 6
+                        int r = 0, R = (m << 1) | (j << 6) | b;
+                        for (int i=0; i<7; i++)
+                            r |= ((R >> i) & 1) << (6-i);
+                        sign[b][j][o][m/8][m%8] = output_map(o, r) ? 1 : -1;
+                    }
+    }
+};
+
+static inline uint64_t pack_decisions(const v8s d[8])
+{
+    // lanes are 0 or -1; gather one bit from each into a single word
+    uint64_t result = 0;
+    for (int i=0; i<8; i++)
+    {
+        uint64_t w;
+        v8c c = __builtin_convertvector(d[i], v8c);
+        memcpy(&w, &c, sizeof(w));
+        result |= ((w & 0x8040201008040201ull) * 0x0101010101010101ull >> 56) << (8*i);
+    }
+    return result;
+}
+
+// Run add-compare-select over N trellis steps.  llr holds 2*N soft bits and
+// decisions receives N words.  metrics is read and updated in place.
+static void acs(const int8_t *llr, long N, const ACSTables &t, int16_t metrics[64], uint64_t *decisions)
+{
+    v8s pm[8];
+    memcpy(pm, metrics, sizeof(pm));
+    for (long k=0; k<N; k++)
+    {
+        v8s l0 = v8s{} + (int16_t)llr[2*k+0];
+        v8s l1 = v8s{} + (int16_t)llr[2*k+1];
+        v8s d[8], next[8];
+        for (int b=0; b<2; b++)
+            for (int i=0; i<4; i++)
+            {
+                v8s c0 = pm[i]   + l0*t.sign[b][0][0][i] + l1*t.sign[b][0][1][i];
+                v8s c1 = pm[i+4] + l0*t.sign[b][1][0][i] + l1*t.sign[b][1][1][i];
+                d[4*b+i] = c1 > c0;
+                next[4*b+i] = (c1 & d[4*b+i]) | (c0 & ~d[4*b+i]);
+            }
+        decisions[k] = pack_decisions(d);
+        for (int i=0; i<4; i++)
+        {
+            pm[2*i+0] = __builtin_shufflevector(next[i], next[i+4], 0, 8, 1, 9, 2,10, 3,11);
+            pm[2*i+1] = __builtin_shufflevector(next[i], next[i+4], 4,12, 5,13, 6,14, 7,15);
+        }
+        // renormalize on the last step too, so that callers feeding a few
+        // steps at a time still do
+        if (k % acs_renorm_interval == acs_renorm_interval-1 || k == N-1)
+        {
+            int16_t ref = pm[0][0];
+            for (int i=0; i<8; i++)
+                pm[i] -= ref;
+        }
+    }
+    memcpy(metrics, pm, sizeof(pm));
+}
+
+// Trace back from state n at the last of N steps, writing N decoded bits.
+static void traceback(const uint64_t *decisions, long N, int n, uint8_t *msg)
+{
+    for (long k=N-1; k>=0; k--)
+    {
+        msg[k] = n & 1;
+        n = (n >> 1) | (int)((decisions[k] >> ((n >> 1) | ((n & 1) << 5))) & 1) << 5;
+    }
+}
+
+template<class T, int N>
+static blitz::Array<T,N> convert_to_contiguous_blitz(PyArrayObject* arr_obj, const char* name)
+{
+    if (!PyArray_IS_C_CONTIGUOUS(arr_obj))
+    {
+        PyErr_Format(PyExc_TypeError, "Conversion Error: array argument '%s' is not contiguous", name);
+        throw 1;
+    }
+    return convert_to_blitz<T,N>(arr_obj, name);
+}
+
+static PyObject* decode(PyObject*self, PyObject* args)
+{
+    PyArrayObject *py_llr = NULL, *py_output_map = NULL, *py_msg = NULL;
+    long N;
+    if(!PyArg_ParseTuple(args,"lO!O!:decode",&N,&PyArray_Type,&py_llr,&PyArray_Type,&py_output_map))
+        return NULL;
+    try
+    {
+        auto llr = convert_to_contiguous_blitz<npy_byte,1>(py_llr,"llr");
+        auto output_map = convert_to_blitz<long,2>(py_output_map,"output_map");
+        if (llr.extent(blitz::firstDim) < 2*N)
+        {
+            PyErr_SetString(PyExc_ValueError, "llr must hold 2*N soft bits");
+            throw 1;
+        }
+        npy_intp dims[] = {N};
+        py_msg = (PyArrayObject *)PyArray_SimpleNew(1, dims, NPY_UBYTE);
+        ACSTables tables(output_map);
+        int16_t metrics[64] = {/* zero-initialized */};
+        std::vector<uint64_t> decisions(N);
+        Py_BEGIN_ALLOW_THREADS
+        acs((const int8_t *)llr.data(), N, tables, metrics, decisions.data());
+        traceback(decisions.data(), N, 0, (uint8_t *)PyArray_DATA(py_msg));
+        Py_END_ALLOW_THREADS
+        return (PyObject *)py_msg;
+    }
+    catch(...)
+    {
+        Py_XDECREF(py_msg);
+        return nullptr;
+    }
+}
+
+// Incremental interface to the Viterbi engine: acs(llr, output_map, metrics,
+// decisions) advances the path metrics in place by decisions.size steps, and
+// traceback(decisions, state) returns the bits along the survivor path that
+// ends in the given state.
+static PyObject* acs(PyObject*self, PyObject* args)
+{
+    PyArrayObject *py_llr = NULL, *py_output_map = NULL, *py_metrics = NULL, *py_decisions = NULL;
+    if(!PyArg_ParseTuple(args,"O!O!O!O!:acs",&PyArray_Type,&py_llr,&PyArray_Type,&py_output_map,
+                         &PyArray_Type,&py_metrics,&PyArray_Type,&py_decisions))
+        return NULL;
+    try
+    {
+        auto llr = convert_to_contiguous_blitz<npy_byte,1>(py_llr,"llr");
+        auto output_map = convert_to_blitz<long,2>(py_output_map,"output_map");
+        auto metrics = convert_to_contiguous_blitz<npy_short,1>(py_metrics,"metrics");
+        auto decisions = convert_to_contiguous_blitz<npy_uint64,1>(py_decisions,"decisions");
+        long N = decisions.extent(blitz::firstDim);
+        if (llr.extent(blitz::firstDim) < 2*N || metrics.extent(blitz::firstDim) != 64)
+        {
+            PyErr_SetString(PyExc_ValueError, "llr must hold 2*decisions.size soft bits and metrics 64 states");
+            throw 1;
+        }
+        ACSTables tables(output_map);
+        Py_BEGIN_ALLOW_THREADS
+        acs((const int8_t *)llr.data(), N, tables, (int16_t *)metrics.data(), (uint64_t *)decisions.data());
+        Py_END_ALLOW_THREADS
+        Py_RETURN_NONE;
+    }
+    catch(...)
+    {
+        return nullptr;
+    }
+}
+
+static PyObject* traceback(PyObject*self, PyObject* args)
+{
+    PyArrayObject *py_decisions = NULL, *py_msg = NULL;
+    int state;
+    if(!PyArg_ParseTuple(args,"O!i:traceback",&PyArray_Type,&py_decisions,&state))
+        return NULL;
+    try
+    {
+        auto decisions = convert_to_contiguous_blitz<npy_uint64,1>(py_decisions,"decisions");
+        npy_intp dims[] = {decisions.extent(blitz::firstDim)};
+        py_msg = (PyArrayObject *)PyArray_SimpleNew(1, dims, NPY_UBYTE);
+        Py_BEGIN_ALLOW_THREADS
+        traceback((const uint64_t *)decisions.data(), dims[0], state & 63, (uint8_t *)PyArray_DATA(py_msg));
+        Py_END_ALLOW_THREADS
         return (PyObject *)py_msg;
     }
     catch(...)
@@ -107,6 +300,68 @@ static PyObject* decode(PyObject*self, PyObject* args)
     }
 }
 
+// Table-driven CRC over octets whose bits enter the register LSB first,
+// eight octets per step (slicing-by-8).  The register is kept bit-reflected
+// in the low bits of r, and tables[k][b] is the register contribution of
+// octet b followed by k more octets.
+static uint32_t crc(const uint8_t *p, long n, const npy_uint (*t)[256], uint32_t r)
+{
+    for (; n >= 8; p += 8, n -= 8)
+    {
+        uint32_t lo = (p[0] | p[1] << 8 | p[2] << 16 | (uint32_t)p[3] << 24) ^ r;
+        uint32_t hi = (p[4] | p[5] << 8 | p[6] << 16 | (uint32_t)p[7] << 24);
+        r = t[7][lo & 0xff] ^ t[6][(lo >> 8) & 0xff] ^ t[5][(lo >> 16) & 0xff] ^ t[4][lo >> 24] ^
+            t[3][hi & 0xff] ^ t[2][(hi >> 8) & 0xff] ^ t[1][(hi >> 16) & 0xff] ^ t[0][hi >> 24];
+    }
+    for (; n; p++, n--)
+        r = (r >> 8) ^ t[0][(r ^ *p) & 0xff];
+    return r;
+}
+
+// crc(data, bounds, tables, init) runs the CRC from init over each message
+// data[bounds[i]:bounds[i+1]] and returns the final registers.
+static PyObject* crc(PyObject*self, PyObject* args)
+{
+    PyArrayObject *py_data = NULL, *py_bounds = NULL, *py_tables = NULL, *py_r = NULL;
+    unsigned long init;
+    if(!PyArg_ParseTuple(args,"O!O!O!k:crc",&PyArray_Type,&py_data,&PyArray_Type,&py_bounds,
+                         &PyArray_Type,&py_tables,&init))
+        return NULL;
+    try
+    {
+        auto data = convert_to_contiguous_blitz<npy_ubyte,1>(py_data,"data");
+        auto bounds = convert_to_blitz<long,1>(py_bounds,"bounds");
+        auto tables = convert_to_contiguous_blitz<npy_uint,2>(py_tables,"tables");
+        long M = bounds.extent(blitz::firstDim) - 1, D = data.extent(blitz::firstDim);
+        if (M < 0 || tables.extent(blitz::firstDim) != 8 || tables.extent(blitz::secondDim) != 256)
+        {
+            PyErr_SetString(PyExc_ValueError, "bounds must be non-empty and tables 8x256");
+            throw 1;
+        }
+        for (long i=0; i<M; i++)
+            if (bounds(i) < 0 || bounds(i) > bounds(i+1) || bounds(i+1) > D)
+            {
+                PyErr_SetString(PyExc_ValueError, "bounds must be non-decreasing and within data");
+                throw 1;
+            }
+        npy_intp dims[] = {M};
+        py_r = (PyArrayObject *)PyArray_SimpleNew(1, dims, NPY_UINT);
+        npy_uint *r = (npy_uint *)PyArray_DATA(py_r);
+        const uint8_t *p = (const uint8_t *)data.data();
+        const npy_uint (*t)[256] = (const npy_uint (*)[256])tables.data();
+        Py_BEGIN_ALLOW_THREADS
+        for (long i=0; i<M; i++)
+            r[i] = crc(p + bounds(i), bounds(i+1) - bounds(i), t, (uint32_t)init);
+        Py_END_ALLOW_THREADS
+        return (PyObject *)py_r;
+    }
+    catch(...)
+    {
+        Py_XDECREF(py_r);
+        return nullptr;
+    }
+}
+
 static PyObject* encode(PyObject *self, PyObject *args)
 {
     PyArrayObject *py_y = NULL, *py_output_map = NULL, *py_output = NULL;
@@ -119,12 +374,14 @@ static PyObject* encode(PyObject *self, PyObject *args)
         auto output = convert_to_blitz<npy_ubyte,1>(py_output,"output");
         auto output_map = convert_to_blitz<long,2>(py_output_map,"output_map");
         int sh = 0, N = y.extent(blitz::firstDim);
+        Py_BEGIN_ALLOW_THREADS
         for (int i=0; i<N; i++)
         {
             sh = (sh>>1) ^ ((int)y(i) << 6);
             output(2*i+0) = output_map(0,sh);
             output(2*i+1) = output_map(1,sh);
         }
+        Py_END_ALLOW_THREADS
         return (PyObject *)py_output;
     }
     catch(...)
@@ -138,6 +395,9 @@ static PyMethodDef compiled_methods[] =
 {
     {"crc", (PyCFunction)crc, METH_VARARGS},
     {"decode", (PyCFunction)decode, METH_VARARGS},
+    {"decode_reference", (PyCFunction)decode_reference, METH_VARARGS},
+    {"acs", (PyCFunction)acs, METH_VARARGS},
+    {"traceback", (PyCFunction)traceback, METH_VARARGS},
     {"encode", (PyCFunction)encode, METH_VARARGS},
     {NULL, NULL}
 };
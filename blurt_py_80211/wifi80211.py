@@ -264,8 +264,7 @@ def demodulate(input, (G, uncertainty, var_n), drawingCalls=None):
         i += 1
     if len(demapped_bits) == 0:
         return None, None, 0
-    punctured_bits_estimate = interleaver.interleave(np.concatenate(demapped_bits), Ncbps, Nbpsc, True)
-    coded_bits = code.depuncture(punctured_bits_estimate, r_est.puncturingMatrix)
+    coded_bits = interleaver.deinterleave_depuncture(np.concatenate(demapped_bits), Ncbps, Nbpsc, r_est.puncturingMatrix)
     if coded_bits.size < length_coded_bits:
         return None, None, 0
     return coded_bits[:length_coded_bits], length_bits, j